@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from .context import krbcontext, krbContext  # noqa
+from .decorators import with_krbcontext  # noqa
+from .current import current_krbcontext, use_krbcontext  # noqa
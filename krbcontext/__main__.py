@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Command line interface to initialize, check and renew many ccaches"""
+
+import argparse
+import json
+import logging
+import sys
+
+from .batch import check_contexts, init_contexts, load_contexts
+from .daemon import RenewalDaemon
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m krbcontext",
+        description="Initialize or check ccaches of contexts defined in a "
+        "configuration file, and report results in JSON.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Maximum number of contexts handled in parallel.",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND")
+    subparsers.required = True
+
+    init_parser = subparsers.add_parser(
+        "init", help="Initialize ccaches when necessary."
+    )
+    init_parser.add_argument("config", help="Configuration file of contexts.")
+    init_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Renew ccaches even if credentials in them are valid.",
+    )
+
+    check_parser = subparsers.add_parser(
+        "check", help="Check ccaches without initializing them."
+    )
+    check_parser.add_argument("config", help="Configuration file of contexts.")
+    check_parser.add_argument(
+        "--min-lifetime",
+        type=int,
+        default=1,
+        help="Minimum remaining lifetime in seconds of a valid ccache. "
+        "Default is 1.",
+    )
+
+    daemon_parser = subparsers.add_parser(
+        "daemon",
+        help="Renew ccaches periodically and answer queries about them over "
+        "a Unix domain socket.",
+    )
+    daemon_parser.add_argument(
+        "config", help="Configuration file of contexts."
+    )
+    daemon_parser.add_argument(
+        "--socket",
+        required=True,
+        help="Path of Unix domain socket to listen on.",
+    )
+    daemon_parser.add_argument(
+        "--interval",
+        type=int,
+        default=60,
+        help="Seconds between two checks of ccaches. Default is 60.",
+    )
+    daemon_parser.add_argument(
+        "--min-lifetime",
+        type=int,
+        default=600,
+        help="Renew a ccache when remaining lifetime in seconds is less than "
+        "this. Default is 600.",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run command line and return exit code
+
+    Exit code is 1 if any context fails or, for ``check``, any ccache is not
+    valid long enough.
+    """
+    args = parse_args(argv)
+    try:
+        contexts = load_contexts(args.config)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    if args.command == "daemon":
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+        )
+        try:
+            daemon = RenewalDaemon(
+                contexts,
+                args.socket,
+                interval=args.interval,
+                min_lifetime=args.min_lifetime,
+            )
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.command == "init":
+        results = init_contexts(
+            contexts, max_workers=args.jobs, force=args.force
+        )
+        failed = any(result["last_error"] for result in results.values())
+    else:
+        results = check_contexts(contexts, max_workers=args.jobs)
+        failed = any(
+            result["last_error"] or result["lifetime"] < args.min_lifetime
+            for result in results.values()
+        )
+
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
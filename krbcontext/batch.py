@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Work with many contexts at once"""
+
+import configparser
+import functools
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .context import DEFAULT_CCACHE, is_collection, krbContext
+
+__all__ = (
+    "load_contexts",
+    "init_contexts",
+    "check_contexts",
+    "init_with_passwords",
+)
+
+# Options of krbContext which are not strings, and how to read them from a
+# section of configuration file.
+_OPTION_TYPES = {
+    "using_keytab": "boolean",
+    "keytab_in_memory": "boolean",
+    "lazy": "boolean",
+    "trace": "boolean",
+    "impersonation_cache_size": "int",
+    "lifetime": "int",
+    "renew_lifetime": "int",
+    "expiring_threshold": "int",
+    "compact_interval": "int",
+    "soft_expiry": "int",
+}
+
+
+def load_contexts(filename):
+    """Load contexts from a configuration file
+
+    Each section of the file defines a context. Section name is the name of
+    context, and options are passed to ``krbContext`` with same names, e.g.::
+
+        [app]
+        using_keytab = yes
+        principal = app/hostname@EXAMPLE.COM
+        keytab_file = /etc/app/app.keytab
+        ccache_file = /var/run/app/krb5cc
+
+    Boolean options accept ``yes``/``no``, ``true``/``false``, ``on``/``off``
+    and ``1``/``0``, and integer options accept decimal numbers. Each context
+    must have its own ccache, except that contexts of different principals
+    could share a collection. ``ccache_file`` is optional only if there is one
+    context.
+
+    :param str filename: path of the configuration file.
+    :return: a mapping from name to context.
+    :rtype: dict
+    :raises ValueError: the file cannot be read, or a context cannot be
+        created from options of a section, or contexts share a ccache.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    if not parser.read(filename):
+        raise ValueError(f"Cannot read configuration file {filename}.")
+
+    contexts = {}
+    ccaches = set()
+    for name in parser.sections():
+        section = parser[name]
+        options = dict(section)
+        try:
+            for option, option_type in _OPTION_TYPES.items():
+                if option in section:
+                    get = getattr(section, "get" + option_type)
+                    options[option] = get(option)
+            context = krbContext(**options)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid options of context {name}: {e}")
+
+        status = context.status()
+        ccache = status["ccache"]
+        if ccache == DEFAULT_CCACHE and len(parser.sections()) > 1:
+            # All of them would be written into the default ccache.
+            raise ValueError(f"Ccache of context {name} is required.")
+        key = ccache
+        if is_collection(ccache):
+            key = (ccache, str(status["principal"]))
+        if key in ccaches:
+            raise ValueError(
+                f"Ccache {ccache} of context {name} is used by another."
+            )
+        ccaches.add(key)
+        contexts[name] = context
+    return contexts
+
+
+def _run_all(contexts, func, max_workers=None):
+    """Call a function with each context in parallel and report results
+
+    Internal use only.
+    """
+
+    def run(context):
+        start = time.monotonic()
+        error = None
+        try:
+            func(context)
+        except Exception as e:
+            error = str(e)
+        result = context.status()
+        result["last_error"] = error
+        result["elapsed"] = time.monotonic() - start
+        return result
+
+    names = list(contexts)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(run, (contexts[name] for name in names))
+        return dict(zip(names, results))
+
+
+def init_contexts(contexts, max_workers=None, force=False):
+    """Initialize ccaches of contexts in parallel
+
+    Each ccache is initialized only when it is necessary, as what is done when
+    entering a context. ``KRB5CCNAME`` is not changed, so contexts using
+    default ccache get it from current environment.
+
+    :param dict contexts: a mapping from name to context.
+    :param int max_workers: maximum number of threads. It is optional. Default
+        of ``ThreadPoolExecutor`` is used if omitted.
+    :param bool force: indicate whether to initialize ccaches even if
+        credentials in them are valid. It is optional. Default is ``False``.
+    :return: a mapping from name to result of each context, which is what
+        ``krbContext.status`` returns, plus ``elapsed`` seconds of
+        initialization. ``last_error`` is the message of error raised by
+        initialization, or ``None`` if it succeeds.
+    :rtype: dict
+    """
+    init = functools.partial(krbContext._init_credentials, force=force)
+    return _run_all(contexts, init, max_workers)
+
+
+def check_contexts(contexts, max_workers=None):
+    """Check ccaches of contexts in parallel without initializing them
+
+    :param dict contexts: a mapping from name to context.
+    :param int max_workers: maximum number of threads. It is optional. Default
+        of ``ThreadPoolExecutor`` is used if omitted.
+    :return: a mapping from name to result of each context, in same format as
+        ``init_contexts`` returns.
+    :rtype: dict
+    """
+    return _run_all(contexts, krbContext.probe, max_workers)
+
+
+def init_with_passwords(entries, max_workers=None, force=False):
+    """Get credentials of many principals with passwords in parallel
+
+    :param entries: principals to get credentials for. Each of them is a
+        mapping containing ``principal``, ``password`` and ``ccache_file``,
+        which have same meaning as parameters of ``krbContext``.
+        ``ccache_file`` is optional only if there is one entry.
+    :type entries: iterable of dict
+    :param int max_workers: maximum number of threads. It is optional. Default
+        of ``ThreadPoolExecutor`` is used if omitted.
+    :param bool force: indicate whether to get credentials even if valid ones
+        are in ccaches already. It is optional. Default is ``False``.
+    :return: a mapping from principal to result, in same format as
+        ``init_contexts`` returns.
+    :rtype: dict
+    :raises ValueError: password of a principal is missing, or ccache of a
+        principal is missing when there are many entries, or a principal or
+        ccache appears more than once.
+    """
+    entries = list(entries)
+    contexts = {}
+    ccaches = set()
+    for entry in entries:
+        principal = entry["principal"]
+        if not entry.get("password"):
+            raise ValueError(f"Password of {principal} is required.")
+        if principal in contexts:
+            raise ValueError(f"Principal {principal} appears more than once.")
+        ccache = entry.get("ccache_file")
+        if not ccache and len(entries) > 1:
+            # All of them would be written into the default ccache.
+            raise ValueError(f"Ccache of {principal} is required.")
+        if ccache in ccaches:
+            raise ValueError(f"Ccache {ccache} appears more than once.")
+        ccaches.add(ccache)
+        contexts[principal] = krbContext(
+            principal=principal,
+            password=entry["password"],
+            ccache_file=entry.get("ccache_file"),
+        )
+    return init_contexts(contexts, max_workers=max_workers, force=force)
@@ -15,31 +15,166 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import copy
+import base64
 import getpass
+import logging
 import os
 import pwd
 import sys
 import shutil
 import tempfile
+import time
 
 import gssapi
 
-from threading import Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+from . import krb5_backend, ratelimit, trace as krb5_trace
+from .keytab import MemoryKeytab
 
 __all__ = ("krbContext",)
 
+logger = logging.getLogger(__name__)
+
 
 DEFAULT_CCACHE = "DEFAULT_CCACHE"
 DEFAULT_KEYTAB = "DEFAULT_KEYTAB"
 ENV_KRB5CCNAME = "KRB5CCNAME"
 
+SPNEGO_MECH = gssapi.OID.from_int_seq("1.3.6.1.5.5.2")
+
+# Impersonated credentials whose remaining lifetime in seconds is less than
+# this are acquired again instead of being reused from cache.
+IMPERSONATION_RENEW_MARGIN = 60
+
+# Events subscribers could be notified of.
+EVENTS = ("renewed", "expiring")
+
 
 def get_login():
     """Get current effective user name"""
     return pwd.getpwuid(os.getuid()).pw_name
 
 
+# Names of principals shared by all contexts. Principals a process works with
+# are usually a few, so names are never evicted.
+_principal_names = {}
+_principal_names_lock = Lock()
+
+
+def intern_name(principal, name_type):
+    """Get a shared name object of a principal
+
+    :param str principal: principal name.
+    :param name_type: type of the name.
+    :type name_type: gssapi.NameType
+    :return: the name object, which is created only once for each principal
+        and name type.
+    :rtype: gssapi.Name
+    """
+    key = (principal, name_type)
+    name = _principal_names.get(key)
+    if name is None:
+        with _principal_names_lock:
+            name = _principal_names.get(key)
+            if name is None:
+                name = gssapi.Name(principal, name_type)
+                _principal_names[key] = name
+    return name
+
+
+def is_collection(ccache):
+    """Check whether a ccache name refers to a ``DIR:`` collection
+
+    :param str ccache: name of ccache.
+    :rtype: bool
+    """
+    return ccache.startswith("DIR:") and not ccache.startswith("DIR::")
+
+
+def _ccache_path(ccache):
+    """Get path of a ccache stored in a file, ``None`` if it is not"""
+    if ccache.startswith("FILE:"):
+        return ccache[5:]
+    if ccache.startswith("/"):
+        return ccache
+    return None
+
+
+def _remaining_lifetime(creds):
+    """Get remaining lifetime of a credential in seconds, 0 if expired"""
+    try:
+        return creds.lifetime
+    except gssapi.exceptions.ExpiredCredentialsError:
+        return 0
+
+
+class _AcquisitionPlan(object):
+    """Immutable options to acquire and store credential of a context
+
+    Options passed to GSSAPI are built once from cleaned options when context
+    is created, and they are shared by all acquisitions afterwards. They must
+    not be modified.
+
+    Internal use only.
+    """
+
+    __slots__ = (
+        "using_keytab",
+        "principal",
+        "ccache",
+        "collection",
+        "password",
+        "creds_opts",
+        "keytab_store",
+        "ccache_store",
+        "lifetime_opts",
+    )
+
+    def __init__(self, cleaned_options):
+        """Build plan from options cleaned by ``krbContext.clean_options``"""
+        principal = cleaned_options["principal"]
+        ccache = cleaned_options["ccache"]
+        keytab = cleaned_options.get("keytab", DEFAULT_KEYTAB)
+
+        keytab_store = {}
+        if keytab != DEFAULT_KEYTAB:
+            keytab_store["client_keytab"] = keytab
+        # Principal's ccache in a collection is found via KRB5CCNAME, since
+        # naming the collection in store refers to its primary ccache.
+        collection = ccache != DEFAULT_CCACHE and is_collection(ccache)
+        ccache_store = None
+        if ccache != DEFAULT_CCACHE and not collection:
+            ccache_store = {"ccache": ccache}
+
+        creds_opts = {"usage": "initiate", "name": principal}
+        if keytab_store or ccache_store:
+            creds_opts["store"] = dict(keytab_store, **(ccache_store or {}))
+
+        lifetime_opts = {}
+        if cleaned_options.get("lifetime") is not None:
+            lifetime_opts["lifetime"] = cleaned_options["lifetime"]
+
+        values = {
+            "using_keytab": cleaned_options["using_keytab"],
+            "principal": principal,
+            "ccache": ccache,
+            "collection": collection,
+            "password": cleaned_options["password"],
+            "creds_opts": creds_opts,
+            "keytab_store": keytab_store,
+            "ccache_store": ccache_store,
+            "lifetime_opts": lifetime_opts,
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable.")
+
+
 class krbContext(object):
     """A context manager for Kerberos-related actions
 
@@ -67,6 +202,17 @@ class krbContext(object):
         keytab_file=None,
         ccache_file=None,
         password=None,
+        impersonation_cache_size=128,
+        lazy=False,
+        backend="gssapi",
+        keytab_in_memory=False,
+        keytab_data=None,
+        trace=False,
+        lifetime=None,
+        renew_lifetime=None,
+        expiring_threshold=300,
+        compact_interval=None,
+        soft_expiry=None,
     ):
         """Initialize context
 
@@ -83,10 +229,70 @@ class krbContext(object):
             absolute or relative is okay. It is optional. Default client keytab
             will be used if omitted.
         :param str ccache_file: file name of a credential cache to initialize.
-            It is optional. Default ccache will be used if omitted.
+            It is optional. Default ccache will be used if omitted. A ``DIR:``
+            collection, e.g. ``DIR:/run/app/ccaches``, could be given as well,
+            then principal's ccache in the collection is used and made primary
+            inside context. ``KRB5CCNAME`` is changed only if it does not point
+            to the collection already. ``backend="krb5"`` is required.
         :param str password: user principal's password. It is optional. If
             omitted, program will be blocked and prompts to enter a password
             from command line, which requires program runs in a terminal.
+        :param int impersonation_cache_size: maximum number of users whose
+            impersonated credentials are cached by ``impersonate``. It is
+            optional. Default is 128.
+        :param bool lazy: indicate whether to defer initializing credential
+            cache until credential is used inside context. It is optional.
+            Default is ``False``, credential cache is initialized when entering
+            context. When ``True`` is specified, it is initialized when
+            ``credentials`` is accessed or ``ensure`` is called for the first
+            time inside context, and nothing is done if neither happens.
+        :param str backend: which API is used to acquire and check
+            credential, either ``gssapi`` or ``krb5``. It is optional. Default
+            is ``gssapi``. ``krb5`` requires krb5 Python bindings.
+        :param bool keytab_in_memory: indicate whether to load keys of
+            ``keytab_file`` into a ``MEMORY:`` keytab, so that no disk read
+            happens when initializing credential cache. The file is loaded
+            again once it is replaced or modified, and credential cache is
+            initialized at once if versions of keys change. It is optional.
+            Default is ``False``. krb5 Python bindings are required.
+        :param bytes keytab_data: content of a keytab file, e.g. got from a
+            secret store, which is loaded into a ``MEMORY:`` keytab and used
+            instead of ``keytab_file``. Rotated keys could be loaded by
+            ``load_keytab`` later. krb5 Python bindings are required.
+        :param bool trace: indicate whether to capture trace of Kerberos
+            library while getting new credential from KDC. Parsed trace is
+            available from ``last_trace``. It is optional. Default is
+            ``False``. Tracing is turned on for the whole process during
+            acquisition, so other threads using Kerberos library at same time
+            are traced as well.
+        :param int lifetime: requested lifetime in seconds of new credential.
+            It is optional. Default of Kerberos configuration is used if
+            omitted. KDC may grant a shorter one according to its policy.
+        :param int renew_lifetime: requested renewable lifetime in seconds of
+            new credential. It is optional. Default of Kerberos configuration
+            is used if omitted. ``backend="krb5"`` is required.
+        :param int expiring_threshold: subscribers of ``expiring`` event are
+            notified when credential is found valid for less than this number
+            of seconds. It is optional. Default is 300.
+        :param int compact_interval: seconds between two automatic
+            compactions of ccache by ``compact``, which happen when entering
+            context after ccache is initialized. It is optional. Default is
+            ``None``, ccache is not compacted automatically.
+            ``backend="krb5"`` is required.
+        :param int soft_expiry: when entering context and credential known by
+            context is still valid, but for less than this number of seconds,
+            renewal is started in background by ``renew_in_background`` and
+            current credential is used without waiting. Entering context waits
+            for renewal only if credential is expired. It is optional. Default
+            is ``None``, entering context always waits for renewal. An
+            explicit ``ccache_file`` is required, and password is required if
+            keytab is not used.
+        :raises ValueError: backend is unknown, or ``krb5`` is specified but
+            krb5 Python bindings are not installed, or keytab cannot be
+            loaded into memory, or a collection, ``renew_lifetime`` or
+            ``compact_interval`` is used without ``krb5`` backend, or
+            ``soft_expiry`` is used without ``ccache_file``, or without
+            keytab or password.
         """
         self._cleaned_options = self.clean_options(
             using_keytab=using_keytab,
@@ -95,10 +301,83 @@ class krbContext(object):
             ccache_file=ccache_file,
             password=password,
         )
+
+        self._cleaned_options["lifetime"] = lifetime
+        self._cleaned_options["renew_lifetime"] = renew_lifetime
+
+        self._memory_keytab = None
+        self._keytab_rotated = False
+        if using_keytab and (keytab_in_memory or keytab_data is not None):
+            if keytab_file is None and keytab_data is None:
+                raise ValueError(
+                    "Keytab file is required to load keytab into memory."
+                )
+            self._memory_keytab = MemoryKeytab(
+                filename=keytab_file, data=keytab_data
+            )
+            self._cleaned_options["keytab"] = self._memory_keytab.name
+
+        if backend not in ("krb5", "gssapi"):
+            raise ValueError(f"Unknown backend {backend}.")
+        if ccache_file and is_collection(ccache_file) and backend != "krb5":
+            raise ValueError(
+                "krb5 backend is required to use a ccache collection."
+            )
+        if renew_lifetime is not None and backend != "krb5":
+            raise ValueError(
+                "krb5 backend is required to request renewable lifetime."
+            )
+        if compact_interval is not None and backend != "krb5":
+            raise ValueError(
+                "krb5 backend is required to compact ccache automatically."
+            )
+        if soft_expiry is not None and not (using_keytab or password):
+            raise ValueError(
+                "Keytab or password is required to renew in background."
+            )
+        if soft_expiry is not None and not ccache_file:
+            # Default ccache would be resolved from KRB5CCNAME at the moment
+            # background renewal runs, which may be changed by then.
+            raise ValueError("Ccache is required to renew in background.")
+        self._backend = backend
+        self._build_plan()
         self._original_krb5ccname = None
         self._inited = False
+        self._entered = False
+        self._lazy = lazy
+
+        # State of credential known by this context, which is reported by
+        # status() without doing any I/O.
+        self._expires_at = None
+        self._last_renewal = None
+        self._last_error = None
+        self._granted_lifetime = None
+        self._renew_till = None
+        self._trace = trace
+        self._last_trace = None
+        self._kdc_wait = 0.0
+
+        self._compact_interval = compact_interval
+        self._last_compaction = None
+        self._soft_expiry = soft_expiry
+
+        self._expiring_threshold = expiring_threshold
+        self._subscribers = {event: [] for event in EVENTS}
+        # Subscribers are notified of expiring credential only once.
+        self._expiring_notified = False
 
         self._init_lock = Lock()
+        self._background_lock = Lock()
+        self._background_renewal = None
+
+        self._credentials = None
+        self._impersonation_cache_size = impersonation_cache_size
+        self._impersonated = OrderedDict()
+        self._impersonation_lock = Lock()
+        self._target_names = {}
+        # Credential handle with which a service ticket of each target has
+        # been got.
+        self._negotiated_with = {}
 
     def clean_options(
         self,
@@ -127,7 +406,7 @@ class krbContext(object):
         if using_keytab:
             if principal is None:
                 raise ValueError("Principal is required when using key table.")
-            princ_name = gssapi.Name(
+            princ_name = intern_name(
                 principal, gssapi.NameType.kerberos_principal
             )
 
@@ -140,7 +419,7 @@ class krbContext(object):
         else:
             if principal is None:
                 principal = get_login()
-            princ_name = gssapi.Name(principal, gssapi.NameType.user)
+            princ_name = intern_name(principal, gssapi.NameType.user)
 
         cleaned["using_keytab"] = using_keytab
         cleaned["principal"] = princ_name
@@ -149,47 +428,325 @@ class krbContext(object):
 
         return cleaned
 
+    def _build_plan(self):
+        """Build plan and backend from cleaned options
+
+        Internal use only.
+        """
+        plan = _AcquisitionPlan(self._cleaned_options)
+        krb5 = None
+        if self._backend == "krb5":
+            ccache = collection = None
+            if plan.collection:
+                collection = plan.ccache
+            elif plan.ccache != DEFAULT_CCACHE:
+                ccache = plan.ccache
+            krb5 = krb5_backend.Krb5Backend(
+                str(plan.principal),
+                ccache=ccache,
+                keytab=plan.keytab_store.get("client_keytab"),
+                collection=collection,
+                lifetime=self._cleaned_options["lifetime"],
+                renew_lifetime=self._cleaned_options["renew_lifetime"],
+            )
+        self._plan, self._krb5 = plan, krb5
+
+    def load_keytab(self, data):
+        """Load keys into in-memory keytab, e.g. after they are rotated
+
+        If versions of keys change, credential cache is initialized when it is
+        checked next time, even if credential in it is still valid.
+
+        :param bytes data: content of a keytab file.
+        :raises ValueError: keytab is not kept in memory by this context, or
+            data cannot be parsed.
+        """
+        if self._memory_keytab is None:
+            raise ValueError("Keytab is not kept in memory by this context.")
+        self._keytab_loaded(self._memory_keytab.load(data))
+
+    def _keytab_loaded(self, rotated):
+        """Switch to current in-memory keytab after keys are loaded
+
+        Internal use only.
+        """
+        name = self._memory_keytab.name
+        if self._cleaned_options["keytab"] != name:
+            self._cleaned_options["keytab"] = name
+            self._build_plan()
+        if rotated:
+            self._keytab_rotated = True
+
+    def _check_keytab_rotation(self):
+        """Check whether keys in keytab are rotated since last check
+
+        Internal use only.
+
+        :return: ``True`` if versions of keys change.
+        """
+        keytab = self._memory_keytab
+        if keytab is None:
+            return False
+        self._keytab_loaded(keytab.reload_if_changed())
+        rotated, self._keytab_rotated = self._keytab_rotated, False
+        return rotated
+
+    def _check_with_krb5(self):
+        """Check credential in ccache by krb5 backend
+
+        Internal use only.
+
+        :return: remaining lifetime in seconds, 0 if credential is expired or
+            not present.
+        """
+        lifetime = self._krb5.lifetime()
+        self._checked(lifetime)
+        return lifetime
+
+    def _compact_if_due(self):
+        """Compact ccache if ``compact_interval`` passes since last time
+
+        This is called with lock of context held after ccache is initialized.
+        Failure is logged only, since credential in ccache is still valid.
+
+        Internal use only.
+        """
+        interval = self._compact_interval
+        if interval is None:
+            return
+        last = self._last_compaction
+        if last is not None and time.monotonic() - last < interval:
+            return
+        thread = self._background_renewal
+        if thread is not None and thread.is_alive():
+            # Renewal replaces ccache soon.
+            return
+        try:
+            removed = self.compact()
+        except Exception:
+            self._last_compaction = time.monotonic()
+            logger.warning(
+                "Failed to compact ccache %s", self._plan.ccache, exc_info=True
+            )
+            return
+        if removed["entries"]:
+            logger.info(
+                "Removed %d entries (%d bytes) from ccache %s",
+                removed["entries"],
+                removed["bytes"],
+                self._plan.ccache,
+            )
+
+    def compact(self):
+        """Remove expired tickets from ccache
+
+        Service tickets of every service ever contacted are kept in ccache
+        until it is initialized again, which makes ccache bigger and lookups
+        in it slower. Only TGT and unexpired tickets are kept after
+        compaction, and ccache is replaced atomically. Only a ``FILE:``
+        ccache, or a ccache in a ``DIR:`` collection, could be compacted.
+
+        Like ``renew``, this should not be called while ccache is being
+        initialized by this context, e.g. in another thread entering it.
+
+        :return: a mapping containing number of ``entries`` and ``bytes``
+            removed from ccache.
+        :rtype: dict
+        :raises ValueError: krb5 backend is not used, or ccache is not stored
+            in a file.
+        """
+        if self._krb5 is None:
+            raise ValueError("krb5 backend is required to compact ccache.")
+        self._last_compaction = time.monotonic()
+        return self._krb5.compact()
+
     def init_with_keytab(self):
         """Initialize credential cache with keytab"""
-        creds_opts = {
-            "usage": "initiate",
-            "name": self._cleaned_options["principal"],
-        }
+        if self._check_keytab_rotation():
+            self._renew_with_keytab()
+            return
 
-        store = {}
-        if self._cleaned_options["keytab"] != DEFAULT_KEYTAB:
-            store["client_keytab"] = self._cleaned_options["keytab"]
-        if self._cleaned_options["ccache"] != DEFAULT_CCACHE:
-            store["ccache"] = self._cleaned_options["ccache"]
-        if store:
-            creds_opts["store"] = store
+        if self._krb5 is not None:
+            if not self._check_with_krb5():
+                self._renew_with_keytab()
+            return
 
-        creds = gssapi.Credentials(**creds_opts)
+        creds = gssapi.Credentials(**self._plan.creds_opts)
         try:
-            creds.lifetime
+            self._checked(creds.lifetime)
+            self._credentials = creds
         except gssapi.exceptions.ExpiredCredentialsError:
-            new_creds_opts = copy.deepcopy(creds_opts)
-            # Get new credential and put it into a temporary ccache
-            temp_directory = tempfile.mkdtemp("-krbcontext")
-            temp_ccache = os.path.join(temp_directory, "ccache")
+            self._renew_with_keytab()
+
+    def _wait_for_kdc(self):
+        """Wait until rate limit of requests sent to KDC allows one more
+
+        Internal use only.
+        """
+        limiter = ratelimit.get_limiter()
+        delay = 0.0 if limiter is None else limiter.reserve()
+        self._kdc_wait = delay
+        if delay:
+            time.sleep(delay)
+
+    def _from_kdc(self, acquire):
+        """Call a function getting new credential from KDC
+
+        Request is rate limited, and traced if enabled.
+
+        Internal use only.
+        """
+        self._wait_for_kdc()
+        if not self._trace:
+            return acquire()
+        events = None
+        try:
+            with krb5_trace.capture_trace() as events:
+                # krb5 context reads KRB5_TRACE only when it is created.
+                if self._krb5 is not None:
+                    self._krb5.reset()
+                try:
+                    return acquire()
+                finally:
+                    if self._krb5 is not None:
+                        self._krb5.reset()
+        finally:
+            # Trace of a failed acquisition is kept as well.
+            self._last_trace = events
+
+    def _renewed(self, lifetime, granted=None, renew_till=None):
+        """Remember state of credential got from KDC just now
+
+        Internal use only.
+        """
+        self._last_renewal = time.time()
+        self._expires_at = self._last_renewal + lifetime
+        self._granted_lifetime = lifetime if granted is None else granted
+        self._renew_till = renew_till
+        self._expiring_notified = False
+        self._notify("renewed")
+
+    def _checked(self, lifetime):
+        """Remember remaining lifetime of credential found in ccache
+
+        Internal use only.
+        """
+        self._expires_at = time.time() + lifetime
+        if not self._subscribers["expiring"]:
+            return
+        if 0 < lifetime < self._expiring_threshold:
+            if not self._expiring_notified:
+                self._expiring_notified = True
+                self._notify("expiring")
+        elif lifetime:
+            self._expiring_notified = False
+
+    def subscribe(self, event, callback):
+        """Subscribe to an event of credential
+
+        Events are:
+
+        * ``renewed``: new credential is got from KDC and stored into ccache.
+        * ``expiring``: credential in ccache is found valid for less than
+          ``expiring_threshold`` seconds. It is notified once for each
+          credential.
+
+        Callbacks are called with the context in the thread where event
+        happens, e.g. inside context when entering it. Exceptions raised by
+        them are logged and ignored.
+
+        :param str event: name of the event.
+        :param callback: a callable accepting the context.
+        :raises ValueError: event is unknown.
+        """
+        if event not in EVENTS:
+            raise ValueError(f"Unknown event {event}.")
+        self._subscribers[event].append(callback)
+
+    def unsubscribe(self, event, callback):
+        """Unsubscribe from an event of credential
+
+        :param str event: name of the event.
+        :param callback: the callable passed to ``subscribe``.
+        :raises ValueError: event is unknown, or callback is not subscribed.
+        """
+        if event not in EVENTS:
+            raise ValueError(f"Unknown event {event}.")
+        self._subscribers[event].remove(callback)
+
+    def _notify(self, event):
+        """Call subscribers of an event
+
+        Internal use only.
+        """
+        for callback in list(self._subscribers[event]):
             try:
-                new_creds_opts.setdefault("store", {})["ccache"] = temp_ccache
-                creds = gssapi.Credentials(**new_creds_opts)
-                # Then, store new credential back to original specified ccache,
-                # whatever a given ccache file or the default one.
-                _store = None
-                # If default ccache is used, no need to specify ccache in
-                # store parameter passed to ``creds.store``.
-                if self._cleaned_options["ccache"] != DEFAULT_CCACHE:
-                    _store = {"ccache": store["ccache"]}
+                callback(self)
+            except Exception:
+                logger.exception("Subscriber of %s event failed", event)
+
+    def _renewed_with_krb5(self, lifetime):
+        """Remember state of credential got by krb5 backend just now
+
+        Internal use only.
+        """
+        times = self._krb5.last_times
+        self._renewed(
+            lifetime,
+            granted=times.endtime - (times.starttime or times.authtime),
+            renew_till=times.renew_till or None,
+        )
+
+    def _renew_with_keytab(self, replace=False):
+        """Get new credential with keytab and store it into ccache
+
+        If ``replace`` is true, a ccache stored in a file is replaced
+        atomically.
+
+        Internal use only.
+        """
+        self._from_kdc(lambda: self._acquire_with_keytab(replace))
+
+    def _acquire_with_keytab(self, replace=False):
+        """Internal use only."""
+        plan = self._plan
+        self._credentials = None
+        if self._krb5 is not None:
+            self._renewed_with_krb5(self._krb5.init(replace=replace))
+            return
+
+        # Get new credential and put it into a temporary ccache
+        temp_directory = tempfile.mkdtemp("-krbcontext")
+        temp_ccache = os.path.join(temp_directory, "ccache")
+        try:
+            creds = gssapi.Credentials(
+                usage="initiate",
+                name=plan.principal,
+                store=dict(plan.keytab_store, ccache=temp_ccache),
+                **plan.lifetime_opts,
+            )
+            # Then, store new credential back to original specified ccache,
+            # whatever a given ccache file or the default one. If default
+            # ccache is used, no need to specify ccache in store parameter
+            # passed to ``creds.store``.
+            path = self._replaced_path(replace)
+            if path is None:
                 creds.store(
                     usage="initiate",
-                    store=_store,
+                    store=plan.ccache_store,
                     set_default=True,
                     overwrite=True,
                 )
-            finally:
-                shutil.rmtree(temp_directory, ignore_errors=True)
+            else:
+                with krb5_backend.replacing(path) as temp:
+                    creds.store(
+                        usage="initiate",
+                        store={"ccache": "FILE:" + temp},
+                        overwrite=True,
+                    )
+            self._renewed(_remaining_lifetime(creds))
+        finally:
+            shutil.rmtree(temp_directory, ignore_errors=True)
 
     def init_with_password(self):
         """Initialize credential cache with password
@@ -204,56 +761,312 @@ class krbContext(object):
         :raises IOError: when trying to prompt to input password from command
             line but no attry is available.
         """
-        creds_opts = {
-            "usage": "initiate",
-            "name": self._cleaned_options["principal"],
-        }
-        if self._cleaned_options["ccache"] != DEFAULT_CCACHE:
-            creds_opts["store"] = {"ccache": self._cleaned_options["ccache"]}
+        if self._krb5 is not None:
+            if not self._check_with_krb5():
+                self._renew_with_password()
+            return
 
-        cred = gssapi.Credentials(**creds_opts)
+        cred = gssapi.Credentials(**self._plan.creds_opts)
         try:
-            cred.lifetime
+            self._checked(cred.lifetime)
+            self._credentials = cred
         except gssapi.exceptions.ExpiredCredentialsError:
-            password = self._cleaned_options["password"]
-
-            if not password:
-                if not sys.stdin.isatty():
-                    raise IOError(
-                        "krbContext is not running from a terminal. So, you "
-                        "need to run kinit with your principal manually before"
-                        " anything goes."
-                    )
+            self._renew_with_password()
 
-                # If there is no password specified via API call, prompt to
-                # enter one in order to continue to get credential. BUT, in
-                # some cases, blocking program and waiting for input of
-                # password is really bad, which may be only suitable for some
-                # simple use cases, for example, writing some scripts to test
-                # something that need Kerberos authentication. Anyway, whether
-                # it is really to enter a password from command line, it
-                # depends on concrete use cases totally.
-                password = getpass.getpass()
-
-            cred = gssapi.raw.acquire_cred_with_password(
-                self._cleaned_options["principal"], password.encode("utf-8")
-            )
+    def _replaced_path(self, replace):
+        """Get path of ccache file to replace atomically, if requested
 
-            ccache = self._cleaned_options["ccache"]
-            if ccache == DEFAULT_CCACHE:
-                gssapi.raw.store_cred(
-                    cred.creds,
-                    usage="initiate",
-                    overwrite=True,
-                    set_default=True,
+        Internal use only.
+        """
+        if not replace or self._plan.ccache_store is None:
+            return None
+        return _ccache_path(self._plan.ccache)
+
+    def _renew_with_password(self, replace=False):
+        """Get new credential with password and store it into ccache
+
+        If ``replace`` is true, a ccache stored in a file is replaced
+        atomically.
+
+        Internal use only.
+        """
+        plan = self._plan
+        self._credentials = None
+        password = plan.password
+
+        if not password:
+            if not sys.stdin.isatty():
+                raise IOError(
+                    "krbContext is not running from a terminal. So, you "
+                    "need to run kinit with your principal manually before"
+                    " anything goes."
                 )
-            else:
+
+            # If there is no password specified via API call, prompt to
+            # enter one in order to continue to get credential. BUT, in
+            # some cases, blocking program and waiting for input of
+            # password is really bad, which may be only suitable for some
+            # simple use cases, for example, writing some scripts to test
+            # something that need Kerberos authentication. Anyway, whether
+            # it is really to enter a password from command line, it
+            # depends on concrete use cases totally.
+            password = getpass.getpass()
+
+        self._from_kdc(lambda: self._acquire_with_password(password, replace))
+
+    def _acquire_with_password(self, password, replace=False):
+        """Internal use only."""
+        plan = self._plan
+        if self._krb5 is not None:
+            self._renewed_with_krb5(
+                self._krb5.init(password.encode("utf-8"), replace=replace)
+            )
+            return
+
+        cred = gssapi.raw.acquire_cred_with_password(
+            plan.principal, password.encode("utf-8"), **plan.lifetime_opts
+        )
+
+        path = self._replaced_path(replace)
+        if path is not None:
+            with krb5_backend.replacing(path) as temp:
                 gssapi.raw.store_cred_into(
-                    {"ccache": ccache},
+                    {"ccache": "FILE:" + temp},
                     cred.creds,
                     usage="initiate",
                     overwrite=True,
                 )
+        elif plan.ccache_store is None:
+            gssapi.raw.store_cred(
+                cred.creds,
+                usage="initiate",
+                overwrite=True,
+                set_default=True,
+            )
+        else:
+            gssapi.raw.store_cred_into(
+                plan.ccache_store,
+                cred.creds,
+                usage="initiate",
+                overwrite=True,
+            )
+
+        self._renewed(cred.lifetime)
+
+    def renew(self, replace=False):
+        """Initialize credential cache with new credential even if it is valid
+
+        This does not change ``KRB5CCNAME``, and it should not be called
+        inside context of same instance, since ccache may be initialized by
+        context at same time.
+
+        :param bool replace: indicate whether to replace a ccache stored in a
+            file atomically, so that others using it at same time never see
+            it empty. It is optional. Default is ``False``.
+        """
+        self._init_credentials(force=True, replace=replace)
+
+    def renew_in_background(self, min_lifetime=None):
+        """Renew credential in a background thread
+
+        Caller is not blocked. If a renewal started by this method is still
+        running, it is returned instead of starting another one, so calling
+        this frequently, e.g. on every request, is cheap. Error raised by
+        renewal is logged, and is available from ``status``.
+
+        A ccache stored in a file is replaced atomically, so code using it at
+        same time never sees it empty. Default ccache is resolved from
+        ``KRB5CCNAME`` when renewal runs, so it must not be changed then.
+
+        :param int min_lifetime: ccache is checked first, and credential is
+            renewed only if it is valid for less than this number of seconds.
+            It is optional. Credential is renewed without checking if omitted.
+        :return: the thread renewing credential, which could be joined to
+            wait for renewal.
+        :rtype: threading.Thread
+        """
+        with self._background_lock:
+            thread = self._background_renewal
+            if thread is None or not thread.is_alive():
+                thread = Thread(
+                    target=self._renew_quietly,
+                    args=(min_lifetime,),
+                    daemon=True,
+                )
+                thread.start()
+                self._background_renewal = thread
+            return thread
+
+    def _renew_quietly(self, min_lifetime):
+        """Renew credential when necessary and log error
+
+        Internal use only.
+        """
+        try:
+            if min_lifetime is not None and self.probe() >= min_lifetime:
+                # Renewed by others, so error of last renewal is stale.
+                self._last_error = None
+                return
+            self._init_credentials(force=True, replace=True)
+        except Exception:
+            logger.exception(
+                "Failed to renew credential of %s", self._plan.principal
+            )
+
+    @property
+    def credentials(self):
+        """Credential of context principal stored in the ccache
+
+        The credential handle is reused until ccache is initialized again. In
+        lazy mode, accessing it inside context prepares context first.
+
+        :rtype: gssapi.Credentials
+        """
+        if self._entered:
+            self.ensure()
+        creds = self._credentials
+        if creds is None:
+            creds = gssapi.Credentials(**self._plan.creds_opts)
+            self._credentials = creds
+        return creds
+
+    def impersonate(self, user, lifetime=None):
+        """Get credential of a user impersonated by context principal
+
+        Credential is acquired from context principal's credential by
+        S4U2Self, and it can be used to authenticate to services that context
+        principal is allowed to delegate to by S4U2Proxy. Acquired credentials
+        are cached per user and reused until they are about to expire. The
+        least recently used one is evicted when cache is full.
+
+        This should be called inside context, so that context principal's
+        credential is valid.
+
+        :param user: principal name of the user to impersonate.
+        :type user: str or gssapi.Name
+        :param int lifetime: requested lifetime in seconds. It is optional.
+            Default lifetime is requested if omitted.
+        :return: impersonated credential of the user.
+        :rtype: gssapi.Credentials
+        """
+        key = str(user)
+        with self._impersonation_lock:
+            cached = self._impersonated.get(key)
+            if cached is not None:
+                creds, expires_at = cached
+                remaining = expires_at - time.monotonic()
+                if remaining > IMPERSONATION_RENEW_MARGIN:
+                    self._impersonated.move_to_end(key)
+                    return creds
+                del self._impersonated[key]
+
+        if not isinstance(user, gssapi.Name):
+            user = gssapi.Name(user, gssapi.NameType.kerberos_principal)
+        self._wait_for_kdc()
+        creds = self.credentials.impersonate(
+            user, lifetime=lifetime, usage="initiate"
+        )
+        expires_at = time.monotonic() + creds.lifetime
+
+        with self._impersonation_lock:
+            self._impersonated[key] = (creds, expires_at)
+            self._impersonated.move_to_end(key)
+            while len(self._impersonated) > self._impersonation_cache_size:
+                self._impersonated.popitem(last=False)
+
+        return creds
+
+    def copy_to(self, ccaches, min_lifetime=300, max_workers=None):
+        """Copy credential of context principal into other ccaches
+
+        Credential is acquired once by this context, and then copied into
+        given ccaches in parallel, which does not contact KDC at all. A ccache
+        is skipped if it already has credential of context principal, which
+        is valid for at least ``min_lifetime`` seconds.
+
+        This should be called inside context, so that context principal's
+        credential is valid.
+
+        :param ccaches: names of ccaches to copy credential into.
+        :type ccaches: iterable of str
+        :param int min_lifetime: minimum remaining lifetime in seconds of
+            credential in a ccache to skip it. It is optional. Default is 300.
+        :param int max_workers: maximum number of threads to copy credential.
+            It is optional. Default of ``ThreadPoolExecutor`` is used if
+            omitted.
+        :return: a mapping from each ccache to ``True`` if credential is
+            copied into it, or ``False`` if it is skipped.
+        :rtype: dict
+        """
+        ccaches = list(ccaches)
+        # Ensure credential is valid. Each copy uses its own credential handle
+        # read from the ccache, since a handle is locked during storing.
+        self.credentials
+        creds_opts = self._plan.creds_opts
+        principal = self._plan.principal
+
+        def copy(ccache):
+            store = {"ccache": ccache}
+            try:
+                target = gssapi.Credentials(
+                    usage="initiate", name=principal, store=store
+                )
+                if _remaining_lifetime(target) >= min_lifetime:
+                    return False
+            except gssapi.exceptions.GSSError:
+                # ccache does not exist or has no credential of the principal.
+                pass
+            gssapi.Credentials(**creds_opts).store(
+                usage="initiate", store=store, overwrite=True
+            )
+            return True
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(ccaches, executor.map(copy, ccaches)))
+
+    def negotiate_header(self, target):
+        """Build value of HTTP header ``Authorization`` for SPNEGO
+
+        Canonicalized name of target is cached, and credential of context
+        principal is reused, so building header for same target again only
+        needs to create a new security context. Service ticket got for target
+        is stored in the ccache and reused by later calls as well. So only
+        the first call for a target after credential is initialized waits for
+        rate limit of requests sent to KDC, if it is enabled.
+
+        This should be called inside context, so that context principal's
+        credential is valid.
+
+        :param str target: name of target service. It could be a host-based
+            service name, e.g. ``HTTP@www.example.com``, or a Kerberos
+            principal name, e.g. ``HTTP/www.example.com@EXAMPLE.COM``.
+        :return: header value in format ``Negotiate <token>``.
+        :rtype: str
+        """
+        name = self._target_names.get(target)
+        if name is None:
+            if "/" in target:
+                name_type = gssapi.NameType.kerberos_principal
+            else:
+                name_type = gssapi.NameType.hostbased_service
+            name = gssapi.Name(target, name_type).canonicalize(
+                gssapi.MechType.kerberos
+            )
+            self._target_names[target] = name
+
+        creds = self.credentials
+        sec_context = gssapi.SecurityContext(
+            name=name,
+            creds=creds,
+            mech=SPNEGO_MECH,
+            usage="initiate",
+        )
+        if self._negotiated_with.get(target) is not creds:
+            # Service ticket is likely to be got from KDC.
+            self._wait_for_kdc()
+        token = sec_context.step()
+        self._negotiated_with[target] = creds
+        return "Negotiate " + base64.b64encode(token).decode("ascii")
 
     def _prepare_context(self):
         """Prepare context
@@ -265,7 +1078,7 @@ class krbContext(object):
 
         Internal use only.
         """
-        ccache = self._cleaned_options["ccache"]
+        ccache = self._plan.ccache
 
         # Whatever there is KRB5CCNAME was set in current process,
         # original_krb5ccname will contain current value even if None if
@@ -278,23 +1091,194 @@ class krbContext(object):
             # current environment variable should be removed.
             if self._original_krb5ccname:
                 del os.environ[ENV_KRB5CCNAME]
+        elif self._original_krb5ccname == ccache:
+            # Collection is kept in environment, and switching to principal's
+            # ccache in it does not need to change KRB5CCNAME.
+            pass
         else:
             # When not using default ccache to initialize new credential, let
             # us point to the given ccache by KRB5CCNAME.
             os.environ[ENV_KRB5CCNAME] = ccache
 
-        if self._cleaned_options["using_keytab"]:
-            self.init_with_keytab()
+        self._refresh_credentials()
+        if self._plan.collection:
+            self._krb5.switch()
+        self._compact_if_due()
+
+    def _refresh_credentials(self):
+        """Initialize credential cache, or renew it in background if allowed
+
+        If ``soft_expiry`` is set and credential known by context is valid,
+        but for less than ``soft_expiry`` seconds, renewal is started in
+        background and ccache is not checked. Otherwise, wait for renewal in
+        background, if any, and initialize ccache when necessary.
+
+        Internal use only.
+        """
+        soft_expiry = self._soft_expiry
+        if soft_expiry is not None:
+            lifetime = self.status()["lifetime"]
+            if lifetime and lifetime < soft_expiry:
+                self.renew_in_background(soft_expiry)
+                return
+            thread = self._background_renewal
+            if thread is not None:
+                thread.join()
+        self._init_credentials()
+
+    def _init_credentials(self, force=False, replace=False):
+        """Initialize credential cache with keytab or password
+
+        Initialize according to ``using_keytab`` parameter, and remember the
+        error if it fails. If ``force`` is true, credential cache is
+        initialized even if credential is valid, and if ``replace`` is true
+        as well, a ccache stored in a file is replaced atomically.
+
+        Internal use only.
+        """
+        try:
+            if self._plan.using_keytab:
+                if force:
+                    self._renew_with_keytab(replace)
+                else:
+                    self.init_with_keytab()
+            elif force:
+                self._renew_with_password(replace)
+            else:
+                self.init_with_password()
+        except Exception as e:
+            self._last_error = e
+            raise
+        self._last_error = None
+
+    def probe(self):
+        """Check credential in ccache without initializing it
+
+        Neither keytab nor password is used, so KDC is never contacted.
+
+        :return: remaining lifetime of credential in seconds, 0 if credential
+            is expired or not present in ccache.
+        :rtype: int
+        """
+        if self._krb5 is not None:
+            return self._check_with_krb5()
+
+        creds_opts = {"usage": "initiate", "name": self._plan.principal}
+        if self._plan.ccache_store is not None:
+            creds_opts["store"] = self._plan.ccache_store
+        try:
+            lifetime = _remaining_lifetime(gssapi.Credentials(**creds_opts))
+        except gssapi.exceptions.GSSError:
+            # ccache does not exist or has no credential of the principal.
+            lifetime = 0
+        self._checked(lifetime)
+        return lifetime
+
+    def status(self):
+        """Report state of credential known by this context
+
+        State is remembered when credential is checked or initialized by this
+        context. No lock is acquired and no I/O happens, so it is cheap enough
+        to be called frequently, e.g. by a health check.
+
+        :return: a mapping containing ``principal``, ``ccache``,
+            ``lifetime`` (remaining lifetime in seconds, ``None`` if not known
+            yet), ``expires_at`` and ``last_renewal`` (timestamps, ``None`` if
+            not known yet), ``granted_lifetime`` (lifetime in seconds granted
+            by KDC at last renewal, ``None`` if not renewed yet),
+            ``renew_till`` (timestamp until which credential got at last
+            renewal is renewable, ``None`` if it is not renewable or not
+            known), ``kdc_wait`` (seconds last request sent to KDC waited, or
+            is waiting, because of rate limit of the process, see
+            ``krbcontext.ratelimit``), and ``last_error`` (exception raised by
+            last initialization, ``None`` if it succeeded).
+        :rtype: dict
+        """
+        expires_at = self._expires_at
+        lifetime = None
+        if expires_at is not None:
+            lifetime = max(0, int(expires_at - time.time()))
+        return {
+            "principal": str(self._plan.principal),
+            "ccache": self._plan.ccache,
+            "lifetime": lifetime,
+            "expires_at": expires_at,
+            "last_renewal": self._last_renewal,
+            "granted_lifetime": self._granted_lifetime,
+            "renew_till": self._renew_till,
+            "kdc_wait": self._kdc_wait,
+            "last_error": self._last_error,
+        }
+
+    @property
+    def last_trace(self):
+        """Trace of last acquisition of new credential from KDC
+
+        Trace is captured only if context is created with ``trace=True``. Use
+        ``krbcontext.trace.kdc_exchanges`` to get time spent on each request
+        sent to KDC.
+
+        :return: events in trace, or ``None`` if nothing is traced yet.
+        :rtype: list[krbcontext.trace.TraceEvent]
+        """
+        return self._last_trace
+
+    def _restore_context(self):
+        """Restore original value of ``KRB5CCNAME`` changed by context
+
+        Internal use only.
+        """
+        if self._plan.ccache == DEFAULT_CCACHE:
+            if self._original_krb5ccname:
+                os.environ[ENV_KRB5CCNAME] = self._original_krb5ccname
+        elif self._original_krb5ccname == self._plan.ccache:
+            pass
         else:
-            self.init_with_password()
+            if self._original_krb5ccname:
+                os.environ[ENV_KRB5CCNAME] = self._original_krb5ccname
+            else:
+                os.environ.pop(ENV_KRB5CCNAME, None)
+
+        self._original_krb5ccname = None
+
+    def ensure(self):
+        """Prepare context if it is not prepared yet
+
+        In lazy mode, this is called when ``credentials`` is accessed for the
+        first time inside context. Code that uses Kerberos library in other
+        ways, e.g. via a third-party library, has to call it explicitly before
+        that. In non-lazy mode, context is already prepared when entering it,
+        so this does nothing.
+
+        This should be called inside context.
+
+        :return: the context itself.
+        :rtype: krbContext
+        """
+        if not self._inited:
+            try:
+                self._prepare_context()
+            except BaseException:
+                self._restore_context()
+                raise
+            self._inited = True
+        return self
 
     def __enter__(self):
         """Initialize ccache when necessary before executing user code
 
-        Lock is acquired as well before user code executes.
+        Lock is acquired as well before user code executes. In lazy mode,
+        ccache is not initialized until ``ensure`` is called.
         """
         self._init_lock.acquire()
-        self._prepare_context()
+        self._entered = True
+        if not self._lazy:
+            try:
+                self.ensure()
+            except BaseException:
+                self._entered = False
+                self._init_lock.release()
+                raise
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -304,17 +1288,11 @@ class krbContext(object):
         restored correctly, if there was. And, lock gets released as well.
         """
         try:
-            if self._cleaned_options["ccache"] == DEFAULT_CCACHE:
-                if self._original_krb5ccname:
-                    os.environ[ENV_KRB5CCNAME] = self._original_krb5ccname
-            else:
-                if self._original_krb5ccname:
-                    os.environ[ENV_KRB5CCNAME] = self._original_krb5ccname
-                else:
-                    del os.environ[ENV_KRB5CCNAME]
-
-            self._original_krb5ccname = None
+            if self._inited:
+                self._restore_context()
         finally:
+            self._inited = False
+            self._entered = False
             self._init_lock.release()
 
 
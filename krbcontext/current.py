@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Current context of a task or thread
+
+``KRB5CCNAME`` is shared by the whole process, so tasks running on one event
+loop cannot use different principals by entering contexts. Instead, a task
+selects its context by ``use_krbcontext``, which is kept in a context
+variable. It survives ``await`` and is isolated from other tasks, so each task
+gets credential of its own principal from explicit ccache of its context.
+
+Default ccache and ``DIR:`` collections are found via ``KRB5CCNAME``, which is
+shared by all tasks, so contexts using them cannot be selected.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+
+__all__ = (
+    "current_krbcontext",
+    "use_krbcontext",
+    "current_credentials",
+    "ensure_credentials",
+)
+
+
+_current = contextvars.ContextVar("krbcontext", default=None)
+
+
+def current_krbcontext():
+    """Get context selected by current task or thread
+
+    :return: the context, or ``None`` if none is selected.
+    :rtype: krbContext
+    """
+    return _current.get()
+
+
+@contextlib.contextmanager
+def use_krbcontext(context):
+    """Select a context for current task or thread inside ``with`` statement
+
+    ``KRB5CCNAME`` is not changed, and lock of the context is not acquired.
+    Previously selected context is selected again on exit.
+
+    :param context: the context to select.
+    :type context: krbContext
+    :return: a context manager giving the context.
+    :raises ValueError: context uses default ccache or a collection.
+    """
+    _check_ccache(context)
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+
+
+def _check_ccache(context):
+    if context._plan.ccache_store is None:
+        raise ValueError(
+            "krbContext with an explicit ccache, other than a collection, is "
+            "required."
+        )
+
+
+def _selected(context):
+    if context is None:
+        context = _current.get()
+        if context is None:
+            raise ValueError("No krbContext is selected.")
+    else:
+        _check_ccache(context)
+    return context
+
+
+def _init_credentials(context):
+    """Initialize ccache of context when necessary without changing env"""
+    with context._init_lock:
+        context._init_credentials()
+
+
+def current_credentials():
+    """Get credential of current context without checking ccache
+
+    :return: credential of context principal.
+    :rtype: gssapi.Credentials
+    :raises ValueError: no context is selected.
+    """
+    return _selected(None).credentials
+
+
+async def ensure_credentials(context=None):
+    """Initialize ccache of a context when necessary and get credential
+
+    Ccache is checked, and initialized if it is not valid, in a thread of
+    default executor, so event loop is not blocked.
+
+    :param context: the context. It is optional. Current context is used if
+        omitted.
+    :type context: krbContext
+    :return: credential of context principal.
+    :rtype: gssapi.Credentials
+    :raises ValueError: no context is given or selected, or context uses
+        default ccache or a collection.
+    """
+    context = _selected(context)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, _init_credentials, context)
+    return context.credentials
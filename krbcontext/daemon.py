@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Daemon renewing ccaches on behalf of local processes
+
+Daemon owns renewal of a set of ccaches, and answers queries about them over
+a Unix domain socket. A request is a line of JSON object::
+
+    {"command": "status", "ccache": "/var/run/app/krb5cc"}
+
+``command`` is either ``status`` or ``renew``, which renews the ccache before
+answering. If the ccache is being renewed already, ``renew`` waits for that
+renewal instead of renewing again. Response is a line of JSON object with
+``principal``, ``ccache``, ``lifetime``, ``fresh``, ``expires_at``,
+``last_renewal`` and ``last_error``, or only ``error`` if request is invalid.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+
+from threading import Event, Lock, Thread
+
+__all__ = ("RenewalDaemon", "query")
+
+logger = logging.getLogger(__name__)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Handle requests from a client connection, one per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.renewal_daemon.handle_request(
+                    request.get("command"), request.get("ccache")
+                )
+            except (ValueError, AttributeError) as e:
+                response = {"error": f"Invalid request: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class RenewalDaemon(object):
+    """Renew ccaches of contexts and answer queries about them
+
+    :param dict contexts: a mapping from name to context, e.g. what
+        ``krbcontext.batch.load_contexts`` returns.
+    :param str socket_path: path of Unix domain socket to listen on. Existing
+        file at the path is removed. Socket is accessible by owner and group
+        only.
+    :param int interval: seconds between two checks of ccaches. It is
+        optional. Default is 60.
+    :param int min_lifetime: a ccache is renewed when remaining lifetime in
+        seconds is less than this. It is optional. Default is 600.
+    :raises ValueError: two contexts use same ccache, including default
+        ccache.
+    """
+
+    def __init__(self, contexts, socket_path, interval=60, min_lifetime=600):
+        self._contexts = {}
+        for name, context in contexts.items():
+            ccache = context.status()["ccache"]
+            if ccache in self._contexts:
+                raise ValueError(
+                    f"Ccache {ccache} of context {name} is used by another."
+                )
+            self._contexts[ccache] = context
+        self._socket_path = socket_path
+        self._interval = interval
+        self._min_lifetime = min_lifetime
+        self._stopped = Event()
+        self._server = None
+        # Avoid renewing a ccache by the periodic check and clients at the
+        # same time.
+        self._renew_locks = {ccache: Lock() for ccache in self._contexts}
+
+    def refresh(self):
+        """Renew ccaches that are not valid long enough"""
+        for ccache, context in self._contexts.items():
+            try:
+                if context.probe() < self._min_lifetime:
+                    with self._renew_locks[ccache]:
+                        context.renew(replace=True)
+                    logger.info("Renewed ccache %s", ccache)
+            except Exception:
+                logger.exception("Failed to renew ccache %s", ccache)
+
+    def handle_request(self, command, ccache):
+        """Answer a request from client
+
+        :param str command: ``status`` or ``renew``.
+        :param str ccache: name of ccache.
+        :return: response to client.
+        :rtype: dict
+        """
+        context = self._contexts.get(ccache)
+        if context is None:
+            return {"error": f"Unknown ccache {ccache}."}
+        if command == "renew":
+            lock = self._renew_locks[ccache]
+            if lock.acquire(blocking=False):
+                try:
+                    context.renew(replace=True)
+                except Exception:
+                    # Error is reported in status
+                    logger.exception("Failed to renew ccache %s", ccache)
+                finally:
+                    lock.release()
+            else:
+                # Answer with result of the running renewal.
+                with lock:
+                    pass
+        elif command != "status":
+            return {"error": f"Unknown command {command}."}
+
+        status = context.status()
+        if status["last_error"] is not None:
+            status["last_error"] = str(status["last_error"])
+        status["fresh"] = (
+            status["lifetime"] is not None
+            and status["lifetime"] >= self._min_lifetime
+        )
+        return status
+
+    def _renew_forever(self):
+        self.refresh()
+        while not self._stopped.wait(self._interval):
+            self.refresh()
+
+    def serve_forever(self):
+        """Renew ccaches periodically and answer queries until shutdown"""
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        # Socket is created with permissions 0o660 from the beginning, so it
+        # is never accessible by others.
+        umask = os.umask(0o117)
+        try:
+            self._server = _UnixServer(self._socket_path, _RequestHandler)
+        finally:
+            os.umask(umask)
+        self._server.renewal_daemon = self
+
+        renewer = Thread(target=self._renew_forever, daemon=True)
+        renewer.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stopped.set()
+            self._server.server_close()
+            os.unlink(self._socket_path)
+
+    def shutdown(self):
+        """Stop daemon, which is serving in another thread"""
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def query(socket_path, ccache, command="status", timeout=5):
+    """Query a daemon about a ccache
+
+    :param str socket_path: path of Unix domain socket daemon listens on.
+    :param str ccache: name of ccache.
+    :param str command: ``status`` or ``renew``. It is optional. Default is
+        ``status``.
+    :param float timeout: seconds to wait for response. It is optional.
+        Default is 5.
+    :return: response from daemon.
+    :rtype: dict
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        request = {"command": command, "ccache": ccache}
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run functions inside contexts shared by all calls"""
+
+import asyncio
+import contextlib
+import functools
+import inspect
+
+from threading import Lock
+
+from .context import krbContext
+from .current import _check_ccache, _init_credentials, use_krbcontext
+
+__all__ = ("with_krbcontext",)
+
+
+def with_krbcontext(options=None, **context_options):
+    """Decorate a function to run inside a context
+
+    Context is created once and shared by all calls, instead of creating a new
+    one for each call. If options depend on arguments of the call, pass a
+    callable as ``options``, and a context is created once for each distinct
+    options it returns.
+
+    For regular and generator functions, ccache is checked and initialized
+    when necessary before each call, and ``KRB5CCNAME`` points at the ccache
+    while any call is running, as what ``with`` statement does. Lock of
+    context is held only while preparing and restoring context, so calls from
+    different threads run at same time, and a decorated function could call
+    itself. For coroutine and asynchronous generator functions, ccache is
+    initialized when necessary in a thread of default executor before the
+    call runs. ``KRB5CCNAME`` is not changed for them, since environment is
+    shared by all tasks. Instead, context is selected for the task while the
+    call runs, so credential could be got by
+    ``krbcontext.current.current_credentials``, and an explicit
+    ``ccache_file`` other than a collection is required. Context of a call is
+    returned by ``get_context`` of decorated function, which accepts same
+    arguments.
+
+    ::
+
+        @with_krbcontext(using_keytab=True,
+                         principal='app/hostname@EXAMPLE.COM',
+                         ccache_file='/tmp/krb5cc_app')
+        def fetch(url):
+            ...
+
+        @with_krbcontext(lambda tenant, *args: {
+            'using_keytab': True,
+            'principal': f'{tenant}/hostname@EXAMPLE.COM',
+            'ccache_file': f'/tmp/krb5cc_{tenant}',
+        })
+        def fetch_for(tenant, url):
+            ...
+
+    :param options: a callable accepting same arguments as decorated function
+        and returning options of ``krbContext`` for the call. It is optional.
+    :param context_options: options of ``krbContext`` for all calls, which are
+        used if ``options`` is omitted.
+    :return: a decorator.
+    """
+
+    def decorator(func):
+        is_async = inspect.iscoroutinefunction(func) or (
+            inspect.isasyncgenfunction(func)
+        )
+        contexts = {}
+        lock = Lock()
+        # Number of running calls of each context, changed under its lock.
+        running = {}
+
+        @contextlib.contextmanager
+        def entered(context):
+            with context._init_lock:
+                if running.get(context):
+                    context._refresh_credentials()
+                else:
+                    try:
+                        context._prepare_context()
+                    except BaseException:
+                        context._restore_context()
+                        raise
+                running[context] = running.get(context, 0) + 1
+            try:
+                yield context
+            finally:
+                with context._init_lock:
+                    running[context] -= 1
+                    if not running[context]:
+                        del running[context]
+                        context._restore_context()
+
+        def get_context(args, kwargs):
+            if options is None:
+                call_options = context_options
+            else:
+                call_options = options(*args, **kwargs)
+            key = tuple(sorted(call_options.items()))
+            context = contexts.get(key)
+            if context is None:
+                with lock:
+                    context = contexts.get(key)
+                    if context is None:
+                        context = krbContext(**call_options)
+                        if is_async:
+                            # Checked before ccache is initialized by call.
+                            _check_ccache(context)
+                        contexts[key] = context
+            return context
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                context = get_context(args, kwargs)
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, _init_credentials, context)
+                with use_krbcontext(context):
+                    return await func(*args, **kwargs)
+
+        elif inspect.isasyncgenfunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                context = get_context(args, kwargs)
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, _init_credentials, context)
+                with use_krbcontext(context):
+                    async for item in func(*args, **kwargs):
+                        yield item
+
+        elif inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with entered(get_context(args, kwargs)):
+                    return (yield from func(*args, **kwargs))
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with entered(get_context(args, kwargs)):
+                    return func(*args, **kwargs)
+
+        wrapper.get_context = lambda *args, **kwargs: get_context(args, kwargs)
+        return wrapper
+
+    return decorator
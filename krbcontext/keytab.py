@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keep keys of a keytab in memory
+
+Keys are read from a keytab file once, or given as content of a keytab file,
+e.g. from a secret store, and put into a ``MEMORY:`` keytab, which is used by
+Kerberos library without any disk read. Creating a ``MEMORY:`` keytab requires
+krb5 Python bindings.
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import struct
+
+from collections import namedtuple
+from threading import Lock
+
+from . import krb5_backend
+
+__all__ = ("KeytabEntry", "MemoryKeytab", "parse_keytab")
+
+logger = logging.getLogger(__name__)
+
+
+class KeytabEntry(
+    namedtuple(
+        "KeytabEntry",
+        "realm components name_type timestamp kvno enctype key",
+    )
+):
+    """An entry of keytab"""
+
+    __slots__ = ()
+
+    @property
+    def principal(self):
+        """Principal name in format ``component/...@REALM``"""
+        components = "/".join(c.decode("utf-8") for c in self.components)
+        return components + "@" + self.realm.decode("utf-8")
+
+
+# Each load of keys gets a new MEMORY: keytab, so that keys are switched
+# without a moment keytab is empty.
+_generations = itertools.count()
+
+
+class _Reader(object):
+    """Read big-endian fields from content of a keytab file"""
+
+    def __init__(self, data, offset=0, end=None):
+        self.data = data
+        self.offset = offset
+        self.end = len(data) if end is None else end
+
+    def unpack(self, fmt):
+        size = struct.calcsize(fmt)
+        if self.offset + size > self.end:
+            raise ValueError("Keytab is truncated.")
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += size
+        return values if len(values) > 1 else values[0]
+
+    def octets(self):
+        size = self.unpack(">H")
+        if self.offset + size > self.end:
+            raise ValueError("Keytab is truncated.")
+        start, end = self.offset, self.offset + size
+        self.offset = end
+        return self.data[start:end]
+
+
+def parse_keytab(data):
+    """Parse content of a keytab file
+
+    Only version 0x502 of keytab file format is supported, which is what MIT
+    Kerberos and Heimdal write.
+
+    :param bytes data: content of a keytab file.
+    :return: entries in the keytab.
+    :rtype: list[KeytabEntry]
+    :raises ValueError: content is not a supported keytab.
+    """
+    if data[:2] != b"\x05\x02":
+        raise ValueError("Unsupported keytab format.")
+
+    entries = []
+    reader = _Reader(data, offset=2)
+    while reader.offset < reader.end:
+        size = reader.unpack(">i")
+        if size < 0:
+            # A hole left by a removed entry
+            reader.offset += -size
+            continue
+        if reader.offset + size > reader.end:
+            raise ValueError("Keytab is truncated.")
+        entry = _Reader(data, reader.offset, reader.offset + size)
+        reader.offset += size
+
+        count = entry.unpack(">H")
+        realm = entry.octets()
+        components = [entry.octets() for _ in range(count)]
+        name_type, timestamp, kvno, enctype = entry.unpack(">IIBH")
+        key = entry.octets()
+        # 32-bit key version number follows if it is larger than 255.
+        if entry.end - entry.offset >= 4:
+            kvno32 = entry.unpack(">I")
+            if kvno32:
+                kvno = kvno32
+        entries.append(
+            KeytabEntry(
+                realm, components, name_type, timestamp, kvno, enctype, key
+            )
+        )
+    return entries
+
+
+class MemoryKeytab(object):
+    """A ``MEMORY:`` keytab loaded from a keytab file or its content
+
+    :param str filename: keytab file to load keys from. Keys are loaded again
+        by ``reload_if_changed`` once the file is replaced or modified.
+    :param bytes data: content of a keytab file. If given, ``filename`` is
+        ignored, and new keys could be loaded by ``load``.
+    :raises ValueError: krb5 Python bindings are not installed, or keytab
+        cannot be parsed.
+    """
+
+    def __init__(self, filename=None, data=None):
+        if not krb5_backend.available():
+            raise ValueError(
+                "krb5 Python bindings are required to load keytab into "
+                "memory."
+            )
+        if filename is None and data is None:
+            raise ValueError("Either filename or data of keytab is required.")
+
+        self.filename = None if data is not None else filename
+        #: Name of current ``MEMORY:`` keytab, which changes if keys change.
+        self.name = None
+        #: Pairs of principal and key version number of current keys.
+        self.versions = None
+        self._digest = None
+        self._file_id = None
+        self._context = None
+        self._keytab = None
+        self._lock = Lock()
+        self.load(data)
+
+    def load(self, data=None):
+        """Load keys from content of a keytab file, or the file if omitted
+
+        If content is not changed, nothing is done.
+
+        :param bytes data: content of a keytab file.
+        :return: ``True`` if versions of keys are changed since last load.
+        :rtype: bool
+        """
+        krb5 = krb5_backend.krb5
+        with self._lock:
+            file_id = None
+            if data is None:
+                with open(self.filename, "rb") as f:
+                    stat = os.fstat(f.fileno())
+                    data = f.read()
+                file_id = (stat.st_ino, stat.st_mtime_ns)
+
+            digest = hashlib.sha256(data).digest()
+            if digest == self._digest:
+                self._file_id = file_id
+                return False
+            entries = parse_keytab(data)
+
+            context = krb5.init_context()
+            name = f"MEMORY:krbcontext-{os.getpid()}-{next(_generations)}"
+            keytab = krb5.kt_resolve(context, name.encode("utf-8"))
+            for entry in entries:
+                krb5.kt_add_entry(
+                    context,
+                    keytab,
+                    krb5.build_principal(
+                        context, entry.realm, entry.components
+                    ),
+                    entry.kvno,
+                    entry.timestamp,
+                    krb5.init_keyblock(context, entry.enctype, entry.key),
+                )
+
+            versions = frozenset((e.principal, e.kvno) for e in entries)
+            rotated = self.versions is not None and versions != self.versions
+            old_context, old_keytab = self._context, self._keytab
+            self.name = name
+            self.versions = versions
+            self._digest = digest
+            self._file_id = file_id
+            self._context, self._keytab = context, keytab
+
+            if old_keytab is not None:
+                # Do not keep old keys in memory.
+                for entry in list(old_keytab):
+                    krb5.kt_remove_entry(old_context, old_keytab, entry)
+            return rotated
+
+    def reload_if_changed(self):
+        """Load keys again if keytab file is replaced or modified
+
+        Only metadata of the file is read unless it changes. If the file
+        cannot be read or parsed, e.g. while it is being rewritten, error is
+        logged, current keys are kept, and the file is read again by next
+        call.
+
+        :return: ``True`` if versions of keys are changed.
+        :rtype: bool
+        """
+        if self.filename is None:
+            return False
+        try:
+            stat = os.stat(self.filename)
+            if (stat.st_ino, stat.st_mtime_ns) == self._file_id:
+                return False
+            return self.load()
+        except (OSError, ValueError):
+            logger.warning(
+                "Failed to reload keytab %s, keep current keys",
+                self.filename,
+                exc_info=True,
+            )
+            return False
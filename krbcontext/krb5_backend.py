@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Acquire and check credential by krb5 API directly
+
+This backend requires the krb5 Python bindings, which is an optional
+dependency. Compared with GSSAPI, initial credential is stored into target
+ccache directly without a temporary ccache, and lifetime is read from the TGT
+in ccache without acquiring a GSSAPI credential.
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+from threading import local
+
+try:
+    import krb5
+except ImportError:  # pragma: no cover
+    krb5 = None
+
+__all__ = ("available", "Krb5Backend")
+
+
+def available():
+    """Check whether krb5 Python bindings are installed"""
+    return krb5 is not None
+
+
+class _CcacheChanged(Exception):
+    """Ccache is changed by others during compaction"""
+
+
+def _file_id(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextlib.contextmanager
+def replacing(path):
+    """Write a file atomically
+
+    A temporary file is created in same directory, which replaces the file
+    if no error is raised inside, or is removed otherwise.
+
+    :param str path: path of the file.
+    :return: a context manager giving path of the temporary file.
+    """
+    fd, temp = tempfile.mkstemp(
+        prefix=os.path.basename(path) + ".", dir=os.path.dirname(path)
+    )
+    os.close(fd)
+    try:
+        if os.path.exists(path):
+            shutil.copymode(path, temp)
+        yield temp
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp)
+        raise
+
+
+class Krb5Backend(object):
+    """Acquire and check credential of a principal in a ccache
+
+    :param str principal: principal name.
+    :param str ccache: name of ccache, or ``None`` to use default ccache.
+    :param str keytab: name of client keytab, or ``None`` to use default
+        client keytab.
+    :param str collection: name of a ccache collection, e.g.
+        ``DIR:/run/app/ccaches``. If given, ``ccache`` is ignored, and
+        principal's ccache in the collection is used, which is created if not
+        present.
+    :param int lifetime: requested lifetime in seconds of initial credential,
+        or ``None`` to use default of Kerberos configuration.
+    :param int renew_lifetime: requested renewable lifetime in seconds of
+        initial credential, or ``None`` to use default of Kerberos
+        configuration.
+    :raises ValueError: krb5 Python bindings are not installed.
+    """
+
+    def __init__(
+        self,
+        principal,
+        ccache=None,
+        keytab=None,
+        collection=None,
+        lifetime=None,
+        renew_lifetime=None,
+    ):
+        if not available():
+            raise ValueError("krb5 Python bindings are not installed.")
+        self._principal = principal.encode("utf-8")
+        self._ccache = ccache.encode("utf-8") if ccache else None
+        self._keytab = keytab.encode("utf-8") if keytab else None
+        self._collection = collection.encode("utf-8") if collection else None
+        self._lifetime = lifetime
+        self._renew_lifetime = renew_lifetime
+        # Full name of principal's ccache once it is found in collection.
+        self._subsidiary = None
+        #: Times of credential got by last ``init``.
+        self.last_times = None
+        # krb5 context must not be used by threads at same time.
+        self._local = local()
+
+    def _context(self):
+        context = getattr(self._local, "context", None)
+        ccname = None
+        if self._ccache is None and self._collection is None:
+            # krb5 context keeps default ccache name it resolves first, so a
+            # new one is created once KRB5CCNAME changes.
+            ccname = os.environ.get("KRB5CCNAME")
+            if context is not None and ccname != self._local.ccname:
+                context = None
+        if context is None:
+            context = self._local.context = krb5.init_context()
+            self._local.ccname = ccname
+            if self._collection is not None:
+                krb5.cc_set_default_name(context, self._collection)
+        return context
+
+    def reset(self):
+        """Drop krb5 context of current thread
+
+        A new one is created on next use, which reads environment variables
+        like ``KRB5_TRACE`` again.
+        """
+        self._local.context = None
+
+    def _open_ccache(self, context, create=False):
+        if self._collection is not None:
+            return self._find_in_collection(context, create)
+        if self._ccache is None:
+            return krb5.cc_default(context)
+        return krb5.cc_resolve(context, self._ccache)
+
+    def _find_in_collection(self, context, create):
+        """Open principal's ccache in collection
+
+        Collection is searched only once, and found ccache is resolved by its
+        name afterwards.
+        """
+        if self._subsidiary is not None:
+            return krb5.cc_resolve(context, self._subsidiary)
+        try:
+            ccache = krb5.cc_cache_match(
+                context, krb5.parse_name_flags(context, self._principal)
+            )
+        except krb5.Krb5Error:
+            if not create:
+                raise
+            cache_type = self._collection.split(b":", 1)[0]
+            ccache = krb5.cc_new_unique(context, cache_type)
+        self._subsidiary = (
+            krb5.cc_get_type(context, ccache)
+            + b":"
+            + krb5.cc_get_name(context, ccache)
+        )
+        return ccache
+
+    def switch(self):
+        """Make principal's ccache primary in collection
+
+        Nothing is written if it is primary already.
+
+        :raises krb5.Krb5Error: principal's ccache is not present in
+            collection.
+        """
+        context = self._context()
+        ccache = self._open_ccache(context)
+        primary = krb5.cc_default(context)
+        if krb5.cc_get_name(context, primary) != krb5.cc_get_name(
+            context, ccache
+        ):
+            krb5.cc_switch(context, ccache)
+
+    def _tgt_times(self):
+        """Get times of principal's TGT in ccache, ``None`` if not found"""
+        context = self._context()
+        principal = krb5.parse_name_flags(context, self._principal)
+        realm = principal.realm
+        tgt = b"krbtgt/" + realm + b"@" + realm
+        try:
+            ccache = self._open_ccache(context)
+            client = krb5.cc_get_principal(context, ccache)
+            if krb5.unparse_name_flags(context, client) != (
+                krb5.unparse_name_flags(context, principal)
+            ):
+                return None
+            for creds in ccache:
+                if krb5.unparse_name_flags(context, creds.server) == tgt:
+                    return creds.times
+        except krb5.Krb5Error:
+            # ccache does not exist or is not initialized.
+            pass
+        return None
+
+    def lifetime(self):
+        """Get remaining lifetime of principal's TGT in ccache
+
+        :return: remaining lifetime in seconds, 0 if TGT is expired or not
+            present in ccache.
+        :rtype: int
+        """
+        times = self._tgt_times()
+        if times is None:
+            return 0
+        return max(0, int(times.endtime - time.time()))
+
+    def _file_path(self, context, ccache):
+        """Get path of a ccache stored in a file, ``None`` if it is not"""
+        cache_type = krb5.cc_get_type(context, ccache)
+        if cache_type not in (b"FILE", b"DIR"):
+            return None
+        path = krb5.cc_get_name(context, ccache).decode("utf-8")
+        # Name of a ccache in DIR: collection is its path after a colon.
+        if path.startswith(":"):
+            path = path[1:]
+        return path
+
+    def init(self, password=None, replace=False):
+        """Get initial credential and store it into ccache
+
+        :param bytes password: password of principal. It is optional. Client
+            keytab is used if omitted.
+        :param bool replace: indicate whether to write new credential into a
+            temporary file which then replaces the ccache atomically, so that
+            ccache is never seen empty by others. It is optional. Default is
+            ``False``. It only works for a ccache stored in a file.
+        :return: remaining lifetime in seconds of new credential.
+        :rtype: int
+        :raises krb5.Krb5Error: fail to get or store credential.
+        """
+        context = self._context()
+        principal = krb5.parse_name_flags(context, self._principal)
+        options = krb5.get_init_creds_opt_alloc(context)
+        if self._lifetime is not None:
+            krb5.get_init_creds_opt_set_tkt_life(options, self._lifetime)
+        if self._renew_lifetime is not None:
+            krb5.get_init_creds_opt_set_renew_life(
+                options, self._renew_lifetime
+            )
+        if password is None:
+            if self._keytab is None:
+                keytab = krb5.kt_client_default(context)
+            else:
+                keytab = krb5.kt_resolve(context, self._keytab)
+            creds = krb5.get_init_creds_keytab(
+                context, principal, options, keytab
+            )
+        else:
+            creds = krb5.get_init_creds_password(
+                context, principal, options, password
+            )
+
+        ccache = self._open_ccache(context, create=True)
+        path = self._file_path(context, ccache) if replace else None
+        if path is None:
+            krb5.cc_initialize(context, ccache, principal)
+            krb5.cc_store_cred(context, ccache, creds)
+        else:
+            with replacing(path) as temp:
+                staged = krb5.cc_resolve(context, b"FILE:" + temp.encode())
+                krb5.cc_initialize(context, staged, principal)
+                krb5.cc_store_cred(context, staged, creds)
+        if self._collection is not None:
+            krb5.cc_switch(context, ccache)
+        self.last_times = creds.times
+        return max(0, int(creds.times.endtime - time.time()))
+
+    def compact(self):
+        """Remove expired tickets from principal's ccache
+
+        Only a ``FILE:`` ccache, or a ccache in a ``DIR:`` collection, could be
+        compacted. Principal's TGT, configuration entries and unexpired
+        tickets are written into a temporary file in same directory, which
+        then replaces the ccache atomically. If the ccache is changed by
+        others, e.g. renewed by another process, before it is replaced,
+        compaction is given up to keep the change.
+
+        :return: a mapping containing number of ``entries`` and ``bytes``
+            removed from ccache, which are 0 if compaction is given up.
+        :rtype: dict
+        :raises ValueError: ccache is not stored in a file.
+        :raises krb5.Krb5Error: fail to read or write ccache.
+        """
+        context = self._context()
+        ccache = self._open_ccache(context)
+        path = self._file_path(context, ccache)
+        if path is None:
+            cache_type = krb5.cc_get_type(context, ccache).decode()
+            raise ValueError(f"Cannot compact ccache of type {cache_type}.")
+
+        file_id = _file_id(path)
+        client = krb5.cc_get_principal(context, ccache)
+        realm = client.realm
+        tgt = b"krbtgt/" + realm + b"@" + realm
+        now = time.time()
+        kept = []
+        removed = 0
+        for creds in ccache:
+            if (
+                creds.times.endtime > now
+                or creds.server.realm == b"X-CACHECONF:"
+                or krb5.unparse_name_flags(context, creds.server) == tgt
+            ):
+                kept.append(creds)
+            else:
+                removed += 1
+        if not removed:
+            return {"entries": 0, "bytes": 0}
+
+        size = file_id[2]
+        try:
+            with replacing(path) as temp:
+                compacted = krb5.cc_resolve(context, b"FILE:" + temp.encode())
+                krb5.cc_initialize(context, compacted, client)
+                for creds in kept:
+                    krb5.cc_store_cred(context, compacted, creds)
+                if _file_id(path) != file_id:
+                    raise _CcacheChanged()
+        except _CcacheChanged:
+            return {"entries": 0, "bytes": 0}
+        return {"entries": removed, "bytes": size - os.path.getsize(path)}
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WSGI and ASGI middleware binding a context to each worker process
+
+A context is set up once in each worker process, when it handles its first
+request, and ``KRB5CCNAME`` points at the ccache for the whole life of the
+worker, as what ``krbcontext.process.init_worker`` does. For each request,
+only remaining lifetime of credential known by the context is checked, which
+does no I/O and acquires no lock. Credential about to expire is renewed in a
+background thread, and a request waits only if credential is expired.
+
+Seconds spent on checking credential of a request is put into WSGI environ or
+ASGI scope as ``krbcontext.elapsed``, and optionally into response header
+``Server-Timing``. The context is available as ``krbcontext.context``.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from threading import Lock
+
+from .context import krbContext
+from .process import _bind_process
+
+__all__ = ("KrbWSGIMiddleware", "KrbASGIMiddleware")
+
+logger = logging.getLogger(__name__)
+
+
+class _WorkerBinding(object):
+    """Context of current worker process, which is set up on first use
+
+    Internal use only.
+    """
+
+    def __init__(self, context_options, min_lifetime):
+        self._context_options = context_options
+        self._min_lifetime = min_lifetime
+        self._lock = Lock()
+        self._pid = None
+        self.context = None
+
+    def ready(self):
+        """Check credential known by context without waiting
+
+        Renewal is started in background if credential is about to expire.
+
+        :return: ``True`` if credential is valid, ``False`` if ``wait`` must
+            be called before handling request.
+        """
+        if self._pid != os.getpid():
+            return False
+        lifetime = self.context.status()["lifetime"]
+        if not lifetime:
+            return False
+        if lifetime < self._min_lifetime:
+            self.context.renew_in_background(self._min_lifetime)
+        return True
+
+    def wait(self):
+        """Set up context of worker, or wait until credential is renewed"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Context created before fork is not used by child process.
+                context = krbContext(**self._context_options)
+                _bind_process(context)
+                self.context = context
+                self._pid = os.getpid()
+                return
+        self.context.renew_in_background(self._min_lifetime).join()
+        status = self.context.status()
+        if not status["lifetime"] and status["last_error"] is not None:
+            raise status["last_error"]
+
+    def check(self):
+        """Ensure credential is valid for a request
+
+        :return: seconds spent on checking.
+        :rtype: float
+        """
+        start = time.monotonic()
+        if not self.ready():
+            self.wait()
+        return self.finish(start)
+
+    def finish(self, start):
+        elapsed = time.monotonic() - start
+        logger.debug(
+            "Credential of %s checked in %.3f ms",
+            self.context.status()["principal"],
+            elapsed * 1000,
+        )
+        return elapsed
+
+
+def _server_timing(elapsed):
+    return f"krbcontext;dur={elapsed * 1000:.3f}"
+
+
+class KrbWSGIMiddleware(object):
+    """WSGI middleware ensuring credential of a context is valid
+
+    ::
+
+        application = KrbWSGIMiddleware(application, {
+            'using_keytab': True,
+            'principal': 'app/hostname@EXAMPLE.COM',
+            'ccache_file': '/var/run/app/krb5cc',
+        })
+
+    :param app: the WSGI application.
+    :param dict context_options: options of ``krbContext``, which is created
+        in each worker process.
+    :param int min_lifetime: credential is renewed in background when it is
+        valid for less than this number of seconds. It is optional. Default
+        is 600.
+    :param bool server_timing: indicate whether to add time spent on checking
+        credential into ``Server-Timing`` header of response. It is optional.
+        Default is ``False``.
+    """
+
+    def __init__(
+        self, app, context_options, min_lifetime=600, server_timing=False
+    ):
+        self.app = app
+        self._binding = _WorkerBinding(context_options, min_lifetime)
+        self._server_timing = server_timing
+
+    def __call__(self, environ, start_response):
+        elapsed = self._binding.check()
+        environ["krbcontext.context"] = self._binding.context
+        environ["krbcontext.elapsed"] = elapsed
+        if not self._server_timing:
+            return self.app(environ, start_response)
+
+        timing = ("Server-Timing", _server_timing(elapsed))
+
+        def timed_start_response(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [timing], exc_info)
+
+        return self.app(environ, timed_start_response)
+
+
+class KrbASGIMiddleware(object):
+    """ASGI middleware ensuring credential of a context is valid
+
+    Setting up context and waiting for renewal happen in a thread of default
+    executor, so event loop is not blocked. Only ``http`` and ``websocket``
+    connections are checked.
+
+    :param app: the ASGI application.
+    :param dict context_options: options of ``krbContext``, which is created
+        in each worker process.
+    :param int min_lifetime: credential is renewed in background when it is
+        valid for less than this number of seconds. It is optional. Default
+        is 600.
+    :param bool server_timing: indicate whether to add time spent on checking
+        credential into ``Server-Timing`` header of HTTP response. It is
+        optional. Default is ``False``.
+    """
+
+    def __init__(
+        self, app, context_options, min_lifetime=600, server_timing=False
+    ):
+        self.app = app
+        self._binding = _WorkerBinding(context_options, min_lifetime)
+        self._server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        binding = self._binding
+        start = time.monotonic()
+        if not binding.ready():
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, binding.wait)
+        elapsed = binding.finish(start)
+        scope = dict(scope)
+        scope["krbcontext.context"] = binding.context
+        scope["krbcontext.elapsed"] = elapsed
+        if not self._server_timing or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timing = (b"server-timing", _server_timing(elapsed).encode("ascii"))
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [timing]
+                message = dict(message, headers=headers)
+            await send(message)
+
+        return await self.app(scope, receive, timed_send)
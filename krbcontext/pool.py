@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Recycle pooled connections after credential is renewed
+
+Connections authenticated by old credential keep working until server drops
+them. Recycling all of them at once when credential is renewed makes every
+client reconnect at same time, so they are recycled one by one over a time
+window instead.
+"""
+
+import logging
+
+from threading import Event, Lock, Thread
+
+__all__ = ("GradualRecycler",)
+
+logger = logging.getLogger(__name__)
+
+
+class GradualRecycler(object):
+    """Recycle connections of a pool evenly over a time window
+
+    An instance could be subscribed to ``renewed`` event of a context
+    directly::
+
+        recycler = GradualRecycler(pool.connections, pool.recycle, window=120)
+        context.subscribe('renewed', recycler)
+
+    :param connections: a callable returning connections to recycle, which is
+        called when recycling starts.
+    :param recycle: a callable accepting a connection, which closes or
+        reconnects it.
+    :param float window: seconds to spread recycling over. It is optional.
+        Default is 60.
+    """
+
+    def __init__(self, connections, recycle, window=60):
+        self._connections = connections
+        self._recycle = recycle
+        self._window = window
+        self._lock = Lock()
+        self._cancelled = None
+        self._thread = None
+
+    def __call__(self, context=None):
+        """Start recycling in a background thread
+
+        Recycling in progress is cancelled, since its remaining connections
+        are recycled by the new one.
+
+        :param context: context whose event triggers recycling. It is ignored.
+        """
+        connections = list(self._connections())
+        cancelled = Event()
+        with self._lock:
+            if self._cancelled is not None:
+                self._cancelled.set()
+            self._cancelled = cancelled
+            self._thread = Thread(
+                target=self._run, args=(connections, cancelled), daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, connections, cancelled):
+        if not connections:
+            return
+        interval = self._window / len(connections)
+        for index, connection in enumerate(connections):
+            if index and cancelled.wait(interval):
+                return
+            try:
+                self._recycle(connection)
+            except Exception:
+                logger.exception("Failed to recycle connection %r", connection)
+
+    def join(self, timeout=None):
+        """Wait until recycling in progress is done
+
+        :param float timeout: seconds to wait. It is optional. Wait forever if
+            omitted.
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def cancel(self):
+        """Cancel recycling in progress"""
+        with self._lock:
+            if self._cancelled is not None:
+                self._cancelled.set()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Set up context once for each worker process
+
+A worker process creates its context once when it starts, and points
+``KRB5CCNAME`` at the ccache for its whole life, so tasks running in it need no
+``with`` statement at all. With ``KrbProcessPoolExecutor``, the ccache is kept
+valid by the parent process before tasks are submitted, and workers never
+contact KDC. Ccache must be shared by processes, e.g. a ``FILE:`` or ``DIR:``
+ccache, but not a ``MEMORY:`` one, and must be given explicitly by
+``ccache_file`` for ``KrbProcessPoolExecutor``.
+"""
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+from .context import DEFAULT_CCACHE, ENV_KRB5CCNAME, krbContext
+
+__all__ = ("init_worker", "worker_context", "KrbProcessPoolExecutor")
+
+
+_worker_context = None
+
+
+def init_worker(options, init=True):
+    """Set up context of current worker process
+
+    It could be used as initializer of a process pool, e.g.
+    ``multiprocessing.Pool(initializer=init_worker, initargs=(options,))``.
+
+    :param dict options: options of ``krbContext``.
+    :param bool init: indicate whether to initialize ccache when necessary.
+        It is optional. Default is ``True``. Pass ``False`` if ccache is kept
+        valid by another process.
+    """
+    global _worker_context
+    context = krbContext(**options)
+    _bind_process(context, init)
+    _worker_context = context
+
+
+def _bind_process(context, init=True):
+    """Point ``KRB5CCNAME`` of current process at ccache of a context"""
+    ccache = context.status()["ccache"]
+    if ccache == DEFAULT_CCACHE:
+        os.environ.pop(ENV_KRB5CCNAME, None)
+    else:
+        os.environ[ENV_KRB5CCNAME] = ccache
+    if init:
+        context._init_credentials()
+
+
+def worker_context():
+    """Get context of current worker process
+
+    :return: the context set up by ``init_worker``.
+    :rtype: krbContext
+    :raises ValueError: context of current process is not set up.
+    """
+    if _worker_context is None:
+        raise ValueError("Context of worker process is not set up.")
+    return _worker_context
+
+
+def _initialize(options, initializer, initargs):
+    init_worker(options, init=False)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class KrbProcessPoolExecutor(ProcessPoolExecutor):
+    """A process pool whose workers share credential kept valid by parent
+
+    Before a task is submitted, parent process checks remaining lifetime of
+    credential it knows, which does no I/O, and checks or initializes ccache
+    only when credential is about to expire. Workers are set up by
+    ``init_worker`` without initializing ccache.
+
+    Python 3.7 or later is required.
+
+    :param dict context_options: options of ``krbContext``. ``ccache_file`` is
+        required, since default ccache of parent, e.g. by its own
+        ``KRB5CCNAME``, might not be the one found by workers.
+    :param int max_workers: maximum number of worker processes. It is
+        optional. Default of ``ProcessPoolExecutor`` is used if omitted.
+    :param int min_lifetime: ccache is initialized again when credential is
+        valid for less than this number of seconds. It should be longer than
+        the longest task. It is optional. Default is 600.
+    :param kwargs: other arguments of ``ProcessPoolExecutor``. ``initializer``
+        is called after context of worker is set up.
+    :raises ValueError: ``ccache_file`` is omitted.
+    """
+
+    def __init__(
+        self, context_options, max_workers=None, min_lifetime=600, **kwargs
+    ):
+        self._context = krbContext(**context_options)
+        if self._context.status()["ccache"] == DEFAULT_CCACHE:
+            raise ValueError(
+                "Ccache is required to share credential with workers."
+            )
+        self._min_lifetime = min_lifetime
+        self._renew_lock = Lock()
+        self.refresh()
+
+        initializer = kwargs.pop("initializer", None)
+        initargs = kwargs.pop("initargs", ())
+        super().__init__(
+            max_workers=max_workers,
+            initializer=_initialize,
+            initargs=(context_options, initializer, initargs),
+            **kwargs,
+        )
+
+    @property
+    def context(self):
+        """Context of parent process"""
+        return self._context
+
+    def refresh(self):
+        """Initialize ccache if credential is about to expire
+
+        Ccache stored in a file is replaced atomically, so workers running
+        tasks at same time never see it empty.
+        """
+        lifetime = self._context.status()["lifetime"]
+        if lifetime is not None and lifetime >= self._min_lifetime:
+            return
+        with self._renew_lock:
+            if self._context.probe() < self._min_lifetime:
+                self._context.renew(replace=True)
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit a task after ensuring credential is valid long enough"""
+        self.refresh()
+        return super().submit(fn, *args, **kwargs)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Limit rate of requests sent to KDC by the whole process
+
+Limit is disabled by default, and is enabled by ``configure``. All contexts
+then share one token bucket. Each time a context gets new credential from KDC,
+impersonates a user, or builds the first SPNEGO header for a target with a
+credential, a token is taken from the bucket, and the request waits if the
+bucket is empty. This keeps a host from flooding KDC when many contexts retry
+at same time, e.g. because of a wrong keytab.
+"""
+
+import time
+
+from threading import Lock
+
+__all__ = ("TokenBucket", "configure", "get_limiter")
+
+
+DEFAULT_RATE = 10
+DEFAULT_BURST = 20
+
+
+class TokenBucket(object):
+    """A token bucket
+
+    :param float rate: tokens added to bucket per second.
+    :param int burst: maximum number of tokens in bucket.
+    :raises ValueError: rate is not positive, or burst is less than 1.
+    """
+
+    def __init__(self, rate, burst):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate must be positive and burst at least 1.")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self):
+        """Take a token, which may be added to bucket in future
+
+        :return: seconds to wait before the token could be used.
+        :rtype: float
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(0, now - self._updated)
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+_limiter = None
+
+
+def configure(rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+    """Enable limit of rate of requests sent to KDC by the process
+
+    :param float rate: requests per second on average, or ``None`` to disable
+        limit. Default is 10.
+    :param int burst: maximum number of requests sent at once. Default is 20.
+    :raises ValueError: rate is not positive, or burst is less than 1.
+    """
+    global _limiter
+    _limiter = None if rate is None else TokenBucket(rate, burst)
+
+
+def get_limiter():
+    """Get token bucket shared by the process
+
+    :return: the token bucket, or ``None`` if limit is disabled.
+    :rtype: TokenBucket
+    """
+    return _limiter
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2013  Chenxiong Qi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Capture and parse trace of MIT Kerberos library
+
+Kerberos library writes trace into the file named by ``KRB5_TRACE`` when a
+library context is created. Trace is captured by pointing that variable at a
+private temporary file while credential is acquired, and it is parsed into
+timed events. There is no API to trace a single library context, so the
+variable is shared by captures running at same time, and it is restored when
+the last of them finishes.
+"""
+
+import contextlib
+import os
+import re
+import tempfile
+
+from collections import namedtuple
+from threading import Lock
+
+__all__ = ("TraceEvent", "capture_trace", "parse_trace", "kdc_exchanges")
+
+
+ENV_KRB5_TRACE = "KRB5_TRACE"
+
+#: An event in trace. ``time`` is the timestamp, ``kind`` is one of
+#: ``request``, ``resolve``, ``connect``, ``send``, ``receive``,
+#: ``kdc_error``, ``preauth``, ``close``, ``store`` and ``other``, and
+#: ``server`` is address of KDC the event is about, if any.
+TraceEvent = namedtuple("TraceEvent", "time kind server message")
+
+_LINE = re.compile(r"^\[\d+\] (\d+\.\d+): (.*)$")
+
+# Patterns are tried in order, the first match gives kind of event.
+_EVENTS = [
+    ("request", re.compile(r"^Sending request \(\d+ bytes\) to (?P<s>\S+)")),
+    ("resolve", re.compile(r"^Resolving hostname (?P<s>\S+)")),
+    ("connect", re.compile(r"^Initiating TCP connection to (?P<s>.+)$")),
+    ("send", re.compile(r"^Sending \w+ (?:\w+ )?request to (?P<s>.+)$")),
+    ("receive", re.compile(r"^Received answer \(\d+ bytes\) from (?P<s>.+)$")),
+    ("kdc_error", re.compile(r"^Received error from KDC: ")),
+    ("preauth", re.compile(r"^(?:Preauth|Processing preauth|Retrying AS)")),
+    ("close", re.compile(r"^Terminating TCP connection to (?P<s>.+)$")),
+    ("store", re.compile(r"^Storing ")),
+]
+
+
+def parse_trace(text):
+    """Parse trace written by Kerberos library
+
+    :param str text: content of trace.
+    :return: events in trace. Lines not in trace format are ignored.
+    :rtype: list[TraceEvent]
+    """
+    events = []
+    for line in text.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        timestamp, message = float(match.group(1)), match.group(2)
+        kind, server = "other", None
+        for name, pattern in _EVENTS:
+            event_match = pattern.match(message)
+            if event_match:
+                kind = name
+                server = event_match.groupdict().get("s")
+                break
+        events.append(TraceEvent(timestamp, kind, server, message))
+    return events
+
+
+def kdc_exchanges(events):
+    """Summarize requests sent to KDC from trace events
+
+    :param events: events in trace.
+    :type events: list[TraceEvent]
+    :return: a list of requests. Each of them is a mapping containing
+        ``realm`` the request is sent to, ``start`` timestamp, ``elapsed``
+        seconds until answer is received, or ``None`` if no answer, KDC
+        ``attempts`` the request is sent to in order, ``server`` that answers,
+        and ``error`` from KDC, if any.
+    :rtype: list[dict]
+    """
+    exchanges = []
+    current = None
+    for event in events:
+        if event.kind == "request":
+            current = {
+                "realm": event.server,
+                "start": event.time,
+                "elapsed": None,
+                "attempts": [],
+                "server": None,
+                "error": None,
+            }
+            exchanges.append(current)
+        elif current is None:
+            continue
+        elif event.kind == "send":
+            current["attempts"].append(event.server)
+        elif event.kind == "receive":
+            current["server"] = event.server
+            current["elapsed"] = event.time - current["start"]
+        elif event.kind == "kdc_error":
+            current["error"] = event.message.split(": ", 1)[1]
+    return exchanges
+
+
+# State of captures running at same time, changed under _lock.
+_lock = Lock()
+_running = 0
+_filename = None
+_original = None
+
+
+@contextlib.contextmanager
+def capture_trace():
+    """Capture trace of Kerberos library contexts created inside
+
+    ``KRB5_TRACE`` is process-wide, so anything using Kerberos library in
+    other threads at same time is traced as well. Captures running at same
+    time share one temporary file, and each of them gets events written while
+    it runs.
+
+    :return: a context manager, which gives a list that is filled with events
+        after exit.
+    """
+    global _running, _filename, _original
+    with _lock:
+        if not _running:
+            fd, _filename = tempfile.mkstemp(prefix="krbcontext-trace-")
+            os.close(fd)
+            _original = os.environ.get(ENV_KRB5_TRACE)
+            os.environ[ENV_KRB5_TRACE] = _filename
+        _running += 1
+        filename = _filename
+        offset = os.path.getsize(filename)
+    events = []
+    try:
+        yield events
+    finally:
+        with _lock:
+            try:
+                with open(filename) as f:
+                    f.seek(offset)
+                    events.extend(parse_trace(f.read()))
+            finally:
+                _running -= 1
+                if not _running:
+                    if _original is None:
+                        os.environ.pop(ENV_KRB5_TRACE, None)
+                    else:
+                        os.environ[ENV_KRB5_TRACE] = _original
+                    os.unlink(filename)
+                    _filename = _original = None
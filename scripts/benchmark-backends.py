@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare cost of checking and initializing ccache with each backend
+
+Usage::
+
+    python3 scripts/benchmark-backends.py -p app/hostname@EXAMPLE.COM \\
+        -k /etc/app/app.keytab -n 100
+
+A scratch ccache is created in a temporary directory for each backend.
+Initializing contacts KDC, so keep the number small against a production KDC.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from krbcontext.context import krbContext
+from krbcontext.krb5_backend import available
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-p", "--principal", required=True)
+    parser.add_argument("-k", "--keytab", default=None)
+    parser.add_argument("-n", "--number", type=int, default=100)
+    return parser.parse_args()
+
+
+def bench(backend, args, tmp_dir):
+    context = krbContext(
+        using_keytab=True,
+        principal=args.principal,
+        keytab_file=args.keytab,
+        ccache_file=os.path.join(tmp_dir, f"krb5cc_{backend}"),
+        backend=backend,
+    )
+    context.renew()
+    check = timeit.timeit(context.init_with_keytab, number=args.number)
+    renew = timeit.timeit(context.renew, number=args.number)
+    print(
+        f"{backend:8} check: {check / args.number * 1000:8.3f} ms  "
+        f"renew: {renew / args.number * 1000:8.3f} ms"
+    )
+
+
+def main():
+    args = parse_args()
+    backends = ["gssapi"]
+    if available():
+        backends.append("krb5")
+    else:
+        print("krb5 Python bindings are not installed, skip krb5 backend.")
+
+    tmp_dir = tempfile.mkdtemp(prefix="krbcontext-bench-")
+    try:
+        for backend in backends:
+            bench(backend, args, tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import gssapi
+
+from unittest.mock import Mock, patch, PropertyMock
+
+from krbcontext.__main__ import main
+from krbcontext.batch import (
+    check_contexts,
+    init_contexts,
+    init_with_passwords,
+    load_contexts,
+)
+from krbcontext.context import krbContext
+
+CONFIG = """\
+[app]
+using_keytab = yes
+principal = app/hostname@EXAMPLE.COM
+ccache_file = /tmp/app_cc
+
+[user]
+principal = cqi
+password = security
+ccache_file = /tmp/cqi_cc
+"""
+
+
+class ConfigFileTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.config = tempfile.mkstemp(suffix=".ini")
+        with os.fdopen(fd, "w") as f:
+            f.write(CONFIG)
+
+    def tearDown(self):
+        os.unlink(self.config)
+
+
+class TestLoadContexts(ConfigFileTestCase):
+    """Test load_contexts"""
+
+    def test_load_contexts(self):
+        contexts = load_contexts(self.config)
+
+        self.assertEqual(["app", "user"], list(contexts))
+        self.assertTrue(contexts["app"]._plan.using_keytab)
+        self.assertEqual("/tmp/app_cc", contexts["app"]._plan.ccache)
+        self.assertFalse(contexts["user"]._plan.using_keytab)
+        self.assertEqual("security", contexts["user"]._plan.password)
+
+    def test_lifetime(self):
+        with open(self.config, "a") as f:
+            f.write("lifetime = 86400\n")
+
+        contexts = load_contexts(self.config)
+
+        self.assertEqual(
+            {"lifetime": 86400}, contexts["user"]._plan.lifetime_opts
+        )
+
+    def test_typed_options(self):
+        with open(self.config, "a") as f:
+            f.write(
+                "lazy = no\n"
+                "trace = true\n"
+                "soft_expiry = 300\n"
+                "expiring_threshold = 600\n"
+                "impersonation_cache_size = 16\n"
+            )
+
+        context = load_contexts(self.config)["user"]
+
+        self.assertIs(False, context._lazy)
+        self.assertIs(True, context._trace)
+        self.assertEqual(300, context._soft_expiry)
+        self.assertEqual(600, context._expiring_threshold)
+        self.assertEqual(16, context._impersonation_cache_size)
+
+    def test_invalid_boolean_option(self):
+        with open(self.config, "a") as f:
+            f.write("lazy = maybe\n")
+
+        self.assertRaises(ValueError, load_contexts, self.config)
+
+    def test_invalid_integer_option(self):
+        with open(self.config, "a") as f:
+            f.write("soft_expiry = soon\n")
+
+        self.assertRaises(ValueError, load_contexts, self.config)
+
+    def test_missing_ccache(self):
+        with open(self.config, "a") as f:
+            f.write("[report]\nprincipal = report\npassword = security\n")
+
+        self.assertRaises(ValueError, load_contexts, self.config)
+
+    def test_duplicate_ccache(self):
+        with open(self.config, "a") as f:
+            f.write(
+                "[report]\n"
+                "principal = report\n"
+                "password = security\n"
+                "ccache_file = /tmp/cqi_cc\n"
+            )
+
+        self.assertRaises(ValueError, load_contexts, self.config)
+
+    def test_default_ccache_for_single_context(self):
+        with open(self.config, "w") as f:
+            f.write("[user]\nprincipal = cqi\npassword = security\n")
+
+        self.assertEqual(["user"], list(load_contexts(self.config)))
+
+    def test_missing_file(self):
+        self.assertRaises(ValueError, load_contexts, "/tmp/no-such-file.ini")
+
+    def test_unknown_option(self):
+        with open(self.config, "a") as f:
+            f.write("unknown = value\n")
+
+        self.assertRaises(ValueError, load_contexts, self.config)
+
+
+class TestRunContexts(unittest.TestCase):
+    """Test init_contexts and check_contexts"""
+
+    def setUp(self):
+        self.contexts = {
+            "app": krbContext(
+                using_keytab=True,
+                principal="app/hostname@EXAMPLE.COM",
+                ccache_file="/tmp/app_cc",
+            ),
+        }
+        patcher = patch("time.time", return_value=1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("gssapi.Credentials")
+    def test_init_contexts(self, Credentials):
+        Credentials.return_value.lifetime = 3600
+
+        results = init_contexts(self.contexts)
+
+        self.assertEqual(3600, results["app"]["lifetime"])
+        self.assertIsNone(results["app"]["last_error"])
+        self.assertIn("elapsed", results["app"])
+
+    @patch("gssapi.Credentials")
+    def test_report_error(self, Credentials):
+        Credentials.side_effect = gssapi.exceptions.GSSError(1, 1)
+
+        results = init_contexts(self.contexts)
+
+        self.assertIsNotNone(results["app"]["last_error"])
+
+    @patch("gssapi.Credentials")
+    def test_check_contexts(self, Credentials):
+        Credentials.side_effect = gssapi.exceptions.MissingCredentialsError(
+            1, 1
+        )
+
+        results = check_contexts(self.contexts)
+
+        self.assertEqual(0, results["app"]["lifetime"])
+        Credentials.assert_called_once_with(
+            usage="initiate",
+            name=self.contexts["app"]._plan.principal,
+            store={"ccache": "/tmp/app_cc"},
+        )
+
+
+class TestInitWithPasswords(unittest.TestCase):
+    """Test init_with_passwords"""
+
+    def setUp(self):
+        self.entries = [
+            {
+                "principal": f"user{i}",
+                "password": f"password{i}",
+                "ccache_file": f"/tmp/user{i}_cc",
+            }
+            for i in range(3)
+        ]
+        patcher = patch("time.time", return_value=1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("gssapi.Credentials")
+    @patch("gssapi.raw.acquire_cred_with_password")
+    @patch("gssapi.raw.store_cred_into")
+    def test_init_all(
+        self, store_cred_into, acquire_cred_with_password, Credentials
+    ):
+        type(Credentials.return_value).lifetime = PropertyMock(
+            side_effect=gssapi.exceptions.ExpiredCredentialsError(1, 1)
+        )
+        acquire_cred_with_password.return_value.lifetime = 3600
+
+        results = init_with_passwords(self.entries, max_workers=2)
+
+        self.assertEqual(["user0", "user1", "user2"], sorted(results))
+        self.assertEqual(3, acquire_cred_with_password.call_count)
+        store_cred_into.assert_any_call(
+            {"ccache": "/tmp/user1_cc"},
+            acquire_cred_with_password.return_value.creds,
+            usage="initiate",
+            overwrite=True,
+        )
+        self.assertEqual(3600, results["user1"]["lifetime"])
+
+    @patch("gssapi.Credentials")
+    @patch("gssapi.raw.acquire_cred_with_password")
+    @patch("gssapi.raw.store_cred_into")
+    def test_force_init(
+        self, store_cred_into, acquire_cred_with_password, Credentials
+    ):
+        acquire_cred_with_password.return_value.lifetime = 3600
+
+        init_with_passwords(self.entries, force=True)
+
+        Credentials.assert_not_called()
+        self.assertEqual(3, store_cred_into.call_count)
+
+    @patch("gssapi.Credentials")
+    @patch("gssapi.raw.acquire_cred_with_password")
+    @patch("gssapi.raw.store_cred_into")
+    def test_report_error_per_principal(
+        self, store_cred_into, acquire_cred_with_password, Credentials
+    ):
+        def acquire(principal, password):
+            if password == b"password1":
+                raise gssapi.exceptions.GSSError(1, 1)
+            return Mock(lifetime=3600)
+
+        acquire_cred_with_password.side_effect = acquire
+
+        results = init_with_passwords(self.entries, force=True)
+
+        self.assertIsNone(results["user0"]["last_error"])
+        self.assertIsNotNone(results["user1"]["last_error"])
+        self.assertIsNone(results["user2"]["last_error"])
+
+    def test_missing_password(self):
+        self.entries[1]["password"] = ""
+
+        self.assertRaises(ValueError, init_with_passwords, self.entries)
+
+    def test_duplicate_principal(self):
+        self.entries[1]["principal"] = "user0"
+
+        self.assertRaises(ValueError, init_with_passwords, self.entries)
+
+    def test_missing_ccache(self):
+        del self.entries[1]["ccache_file"]
+
+        self.assertRaises(ValueError, init_with_passwords, self.entries)
+
+    def test_duplicate_ccache(self):
+        self.entries[1]["ccache_file"] = "/tmp/user0_cc"
+
+        self.assertRaises(ValueError, init_with_passwords, self.entries)
+
+    @patch("krbcontext.batch.init_contexts")
+    def test_default_ccache_for_single_entry(self, init_contexts):
+        del self.entries[0]["ccache_file"]
+
+        init_with_passwords(self.entries[:1])
+
+        contexts = init_contexts.call_args[0][0]
+        self.assertEqual(["user0"], list(contexts))
+
+
+class TestMain(ConfigFileTestCase):
+    """Test command line"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("time.time", return_value=1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_main(self, *argv):
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            code = main(list(argv))
+        return code, json.loads(stdout.getvalue())
+
+    @patch("gssapi.Credentials")
+    def test_init(self, Credentials):
+        Credentials.return_value.lifetime = 3600
+
+        code, results = self.run_main("-j", "2", "init", self.config)
+
+        self.assertEqual(0, code)
+        self.assertEqual(["app", "user"], sorted(results))
+
+    @patch("krbcontext.__main__.init_contexts", return_value={})
+    def test_force_init(self, init_contexts):
+        code, _ = self.run_main("init", "--force", self.config)
+
+        self.assertEqual(0, code)
+        self.assertTrue(init_contexts.call_args[1]["force"])
+
+    @patch("gssapi.Credentials")
+    def test_check_expiring(self, Credentials):
+        Credentials.return_value.lifetime = 60
+
+        code, results = self.run_main(
+            "check", "--min-lifetime", "300", self.config
+        )
+
+        self.assertEqual(1, code)
+        self.assertEqual(60, results["app"]["lifetime"])
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_invalid_config(self, stderr):
+        self.assertEqual(2, main(["init", "/tmp/no-such-file.ini"]))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from unittest.mock import MagicMock
+
+from krbcontext.context import krbContext
+from krbcontext.current import (
+    current_credentials,
+    current_krbcontext,
+    ensure_credentials,
+    use_krbcontext,
+)
+
+
+class TestCurrentContext(unittest.TestCase):
+    """Test selecting current context"""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_select_context(self):
+        first, second = MagicMock(), MagicMock()
+
+        self.assertIsNone(current_krbcontext())
+        with use_krbcontext(first):
+            self.assertIs(first, current_krbcontext())
+            self.assertIs(first.credentials, current_credentials())
+            with use_krbcontext(second):
+                self.assertIs(second, current_krbcontext())
+            self.assertIs(first, current_krbcontext())
+        self.assertIsNone(current_krbcontext())
+
+    def test_no_context_selected(self):
+        self.assertRaises(ValueError, current_credentials)
+        self.assertRaises(
+            ValueError, self.loop.run_until_complete, ensure_credentials()
+        )
+
+    def test_isolated_by_tasks(self):
+        contexts = [MagicMock(), MagicMock()]
+
+        async def run(context):
+            with use_krbcontext(context):
+                await asyncio.sleep(0)
+                selected = current_krbcontext()
+                await asyncio.sleep(0)
+                return selected, await ensure_credentials()
+
+        async def main():
+            return await asyncio.gather(*(run(c) for c in contexts))
+
+        results = self.loop.run_until_complete(main())
+
+        for context, (selected, creds) in zip(contexts, results):
+            self.assertIs(context, selected)
+            self.assertIs(context.credentials, creds)
+            context._init_credentials.assert_called_once_with()
+            context._init_lock.__enter__.assert_called_once()
+
+    def test_explicit_ccache_is_required(self):
+        context = MagicMock()
+        context._plan.ccache_store = None
+
+        with self.assertRaises(ValueError):
+            with use_krbcontext(context):
+                pass
+        self.assertRaises(
+            ValueError,
+            self.loop.run_until_complete,
+            ensure_credentials(context),
+        )
+        context._init_credentials.assert_not_called()
+
+    def test_context_with_default_ccache(self):
+        context = krbContext(principal="cqi")
+
+        with self.assertRaises(ValueError):
+            with use_krbcontext(context):
+                pass
+
+        context = krbContext(principal="cqi", ccache_file="/tmp/cqi_cc")
+        with use_krbcontext(context):
+            self.assertIs(context, current_krbcontext())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+from threading import Event, Thread
+from unittest.mock import Mock
+
+from krbcontext.daemon import RenewalDaemon, query
+
+
+def make_context(ccache, lifetime):
+    context = Mock()
+    context.probe.return_value = lifetime
+    context.status.return_value = {
+        "principal": "app/hostname@EXAMPLE.COM",
+        "ccache": ccache,
+        "lifetime": lifetime,
+        "expires_at": None,
+        "last_renewal": None,
+        "granted_lifetime": None,
+        "renew_till": None,
+        "kdc_wait": 0.0,
+        "last_error": None,
+    }
+    return context
+
+
+class TestRenewalDaemon(unittest.TestCase):
+    """Test RenewalDaemon"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, "krbcontext.sock")
+        self.fresh = make_context("/tmp/fresh_cc", 36000)
+        self.expiring = make_context("/tmp/expiring_cc", 60)
+
+        self.daemon = RenewalDaemon(
+            {"fresh": self.fresh, "expiring": self.expiring},
+            self.socket_path,
+            interval=3600,
+            min_lifetime=600,
+        )
+        self.thread = Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+        while self.daemon._server is None:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_renew_expiring_ccache(self):
+        self.daemon.refresh()
+
+        self.fresh.renew.assert_not_called()
+        self.expiring.renew.assert_called_with(replace=True)
+
+    def test_query_status(self):
+        status = query(self.socket_path, "/tmp/fresh_cc")
+
+        self.assertTrue(status["fresh"])
+        self.assertEqual(36000, status["lifetime"])
+
+        status = query(self.socket_path, "/tmp/expiring_cc")
+        self.assertFalse(status["fresh"])
+
+    def test_force_renew(self):
+        self.fresh.renew.reset_mock()
+
+        query(self.socket_path, "/tmp/fresh_cc", command="renew")
+
+        self.fresh.renew.assert_called_once_with(replace=True)
+
+    def test_socket_permissions(self):
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+
+        self.assertEqual(0o660, mode)
+
+    def test_join_running_renewal(self):
+        started = Event()
+        finish = Event()
+
+        def renew(replace):
+            started.set()
+            finish.wait(5)
+
+        self.fresh.renew.side_effect = renew
+        first = Thread(
+            target=query,
+            args=(self.socket_path, "/tmp/fresh_cc"),
+            kwargs={"command": "renew"},
+        )
+        first.start()
+        started.wait(5)
+
+        second = Thread(
+            target=query,
+            args=(self.socket_path, "/tmp/fresh_cc"),
+            kwargs={"command": "renew"},
+        )
+        second.start()
+        time.sleep(0.1)
+        finish.set()
+        first.join(5)
+        second.join(5)
+
+        self.fresh.renew.assert_called_once_with(replace=True)
+
+    def test_reject_shared_ccache(self):
+        self.assertRaises(
+            ValueError,
+            RenewalDaemon,
+            {
+                "app": make_context("DEFAULT_CCACHE", 3600),
+                "user": make_context("DEFAULT_CCACHE", 3600),
+            },
+            self.socket_path,
+        )
+
+    def test_unknown_ccache(self):
+        response = query(self.socket_path, "/tmp/unknown_cc")
+
+        self.assertIn("error", response)
+
+    def test_unknown_command(self):
+        response = query(self.socket_path, "/tmp/fresh_cc", command="kinit")
+
+        self.assertIn("error", response)
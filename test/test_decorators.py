@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import unittest
+
+from unittest.mock import patch
+
+from krbcontext.current import current_krbcontext
+from krbcontext.decorators import with_krbcontext
+
+
+class TestWithKrbContext(unittest.TestCase):
+    """Test with_krbcontext"""
+
+    def setUp(self):
+        self.krbContext = patch("krbcontext.decorators.krbContext").start()
+        self.context = self.krbContext.return_value
+        self.context._init_lock = threading.Lock()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_share_context_by_calls(self):
+        @with_krbcontext(using_keytab=True, principal="app/h@EXAMPLE.COM")
+        def add(a, b):
+            return a + b
+
+        self.assertEqual(3, add(1, 2))
+        self.assertEqual(7, add(3, 4))
+
+        self.krbContext.assert_called_once_with(
+            using_keytab=True, principal="app/h@EXAMPLE.COM"
+        )
+        self.assertEqual(2, self.context._prepare_context.call_count)
+        self.assertEqual(2, self.context._restore_context.call_count)
+        self.context.__enter__.assert_not_called()
+
+    def test_context_per_options(self):
+        @with_krbcontext(
+            lambda tenant: {"principal": tenant, "ccache_file": f"/{tenant}"}
+        )
+        def run(tenant):
+            return tenant
+
+        run("a")
+        run("b")
+        run("a")
+
+        self.assertEqual(2, self.krbContext.call_count)
+        self.assertIs(self.context, run.get_context("a"))
+
+    def test_generator(self):
+        @with_krbcontext(principal="cqi")
+        def numbers(n):
+            yield from range(n)
+            return n
+
+        self.assertEqual([0, 1, 2], list(numbers(3)))
+        self.context._prepare_context.assert_called_once_with()
+        self.context._restore_context.assert_called_once_with()
+
+    def test_restore_context_on_failure(self):
+        self.context._prepare_context.side_effect = RuntimeError()
+
+        @with_krbcontext(principal="cqi")
+        def run():
+            pass
+
+        self.assertRaises(RuntimeError, run)
+        self.context._restore_context.assert_called_once_with()
+        self.assertFalse(self.context._init_lock.locked())
+
+    def test_concurrent_calls(self):
+        barrier = threading.Barrier(4, timeout=5)
+
+        @with_krbcontext(principal="cqi")
+        def wait():
+            # Fails with BrokenBarrierError if calls are serialized.
+            barrier.wait()
+
+        threads = [threading.Thread(target=wait) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertFalse(barrier.broken)
+        self.context._prepare_context.assert_called_once_with()
+        self.context._restore_context.assert_called_once_with()
+        self.assertEqual(3, self.context._refresh_credentials.call_count)
+
+    def test_recursive_call(self):
+        @with_krbcontext(principal="cqi")
+        def factorial(n):
+            return 1 if n <= 1 else n * factorial(n - 1)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(factorial(5)))
+        thread.start()
+        thread.join(5)
+
+        self.assertEqual([120], results)
+        self.context._prepare_context.assert_called_once_with()
+        self.context._restore_context.assert_called_once_with()
+
+    def test_interleaved_generators(self):
+        @with_krbcontext(principal="cqi")
+        def numbers(n):
+            yield from range(n)
+
+        first = numbers(3)
+        self.assertEqual(0, next(first))
+        self.assertEqual([0, 1], list(numbers(2)))
+        self.assertEqual([1, 2], list(first))
+
+        self.context._prepare_context.assert_called_once_with()
+        self.context._restore_context.assert_called_once_with()
+
+    def test_async_generator(self):
+        @with_krbcontext(principal="cqi")
+        async def numbers(n):
+            self.context._init_credentials.assert_called_once_with()
+            for i in range(n):
+                yield current_krbcontext(), i
+
+        async def collect():
+            return [item async for item in numbers(2)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            items = loop.run_until_complete(collect())
+        finally:
+            loop.close()
+
+        self.assertEqual([(self.context, 0), (self.context, 1)], items)
+        self.context._prepare_context.assert_not_called()
+
+    def test_coroutine(self):
+        @with_krbcontext(principal="cqi")
+        async def double(n):
+            self.context._init_credentials.assert_called_once_with()
+            return n * 2
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(4, loop.run_until_complete(double(2)))
+        finally:
+            loop.close()
+
+        self.context.__enter__.assert_not_called()
+        self.context._prepare_context.assert_not_called()
+
+    def test_coroutine_requires_ccache(self):
+        self.context._plan.ccache_store = None
+
+        @with_krbcontext(principal="cqi")
+        async def double(n):
+            return n * 2
+
+        loop = asyncio.new_event_loop()
+        try:
+            for _ in range(2):
+                self.assertRaises(
+                    ValueError, loop.run_until_complete, double(2)
+                )
+        finally:
+            loop.close()
+
+        self.context._init_credentials.assert_not_called()
+
+    def test_coroutine_selects_context(self):
+        @with_krbcontext(principal="cqi")
+        async def current():
+            return current_krbcontext()
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertIs(self.context, loop.run_until_complete(current()))
+        finally:
+            loop.close()
+        self.assertIsNone(current_krbcontext())
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import tempfile
+import unittest
+
+from unittest.mock import MagicMock, patch
+
+from krbcontext.context import krbContext
+from krbcontext.keytab import MemoryKeytab, parse_keytab
+
+
+def pack_octets(value):
+    return struct.pack(">H", len(value)) + value
+
+
+def make_keytab(*entries):
+    """Make content of a keytab from (principal, kvno, enctype, key)"""
+    data = b"\x05\x02"
+    for principal, kvno, enctype, key in entries:
+        name, realm = principal.encode().split(b"@")
+        components = name.split(b"/")
+        entry = struct.pack(">H", len(components)) + pack_octets(realm)
+        entry += b"".join(pack_octets(c) for c in components)
+        entry += struct.pack(">IIBH", 1, 1700000000, kvno % 256, enctype)
+        entry += pack_octets(key)
+        entry += struct.pack(">I", kvno)
+        data += struct.pack(">i", len(entry)) + entry
+    return data
+
+
+class TestParseKeytab(unittest.TestCase):
+    """Test parse_keytab"""
+
+    def test_parse(self):
+        entries = parse_keytab(
+            make_keytab(
+                ("HTTP/hostname@EXAMPLE.COM", 3, 18, b"k" * 32),
+                ("HTTP/hostname@EXAMPLE.COM", 300, 17, b"k" * 16),
+            )
+        )
+
+        self.assertEqual(2, len(entries))
+        self.assertEqual("HTTP/hostname@EXAMPLE.COM", entries[0].principal)
+        self.assertEqual([b"HTTP", b"hostname"], entries[0].components)
+        self.assertEqual(3, entries[0].kvno)
+        self.assertEqual(18, entries[0].enctype)
+        self.assertEqual(b"k" * 32, entries[0].key)
+        self.assertEqual(300, entries[1].kvno)
+
+    def test_skip_hole(self):
+        data = make_keytab(("app@EXAMPLE.COM", 1, 18, b"k" * 32))
+        data = data[:2] + struct.pack(">i", -4) + b"\0" * 4 + data[2:]
+
+        self.assertEqual(1, len(parse_keytab(data)))
+
+    def test_unsupported_format(self):
+        self.assertRaises(ValueError, parse_keytab, b"\x05\x01")
+
+    def test_truncated(self):
+        data = make_keytab(("app@EXAMPLE.COM", 1, 18, b"k" * 32))
+
+        self.assertRaises(ValueError, parse_keytab, data[:-10])
+
+
+class MemoryKeytabTestCase(unittest.TestCase):
+    def setUp(self):
+        self.krb5 = patch("krbcontext.krb5_backend.krb5").start()
+        self.old_keytab = MagicMock()
+        self.krb5.kt_resolve.side_effect = [self.old_keytab, MagicMock()]
+        self.old_keytab.__iter__.return_value = iter(["entry"])
+
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        self.write_keytab(1)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+        patch.stopall()
+
+    def write_keytab(self, kvno):
+        with open(self.filename, "wb") as f:
+            f.write(make_keytab(("app/hostname@EXAMPLE.COM", kvno, 18, b"k")))
+        # Ensure modification is seen even on filesystems with coarse mtime
+        os.utime(self.filename, ns=(kvno, kvno))
+
+
+class TestMemoryKeytab(MemoryKeytabTestCase):
+    """Test MemoryKeytab"""
+
+    def test_load_from_file(self):
+        keytab = MemoryKeytab(filename=self.filename)
+
+        self.assertTrue(keytab.name.startswith("MEMORY:krbcontext-"))
+        self.assertEqual(
+            frozenset([("app/hostname@EXAMPLE.COM", 1)]), keytab.versions
+        )
+        self.krb5.kt_add_entry.assert_called_once()
+
+    def test_not_reload_if_unchanged(self):
+        keytab = MemoryKeytab(filename=self.filename)
+        name = keytab.name
+
+        self.assertFalse(keytab.reload_if_changed())
+        self.assertEqual(name, keytab.name)
+        self.assertEqual(1, self.krb5.kt_resolve.call_count)
+
+    def test_reload_rotated_keytab(self):
+        keytab = MemoryKeytab(filename=self.filename)
+        name = keytab.name
+        self.write_keytab(2)
+
+        self.assertTrue(keytab.reload_if_changed())
+        self.assertNotEqual(name, keytab.name)
+        self.krb5.kt_remove_entry.assert_called_once_with(
+            self.krb5.init_context.return_value, self.old_keytab, "entry"
+        )
+
+    def test_keep_keys_if_file_is_half_written(self):
+        keytab = MemoryKeytab(filename=self.filename)
+        name = keytab.name
+        data = make_keytab(("app/hostname@EXAMPLE.COM", 2, 18, b"k"))
+        with open(self.filename, "wb") as f:
+            f.write(data[:-10])
+        os.utime(self.filename, ns=(2, 2))
+
+        with self.assertLogs("krbcontext.keytab", level="WARNING"):
+            self.assertFalse(keytab.reload_if_changed())
+        self.assertEqual(name, keytab.name)
+
+        self.write_keytab(2)
+        os.utime(self.filename, ns=(3, 3))
+        self.assertTrue(keytab.reload_if_changed())
+        self.assertNotEqual(name, keytab.name)
+
+    def test_load_data(self):
+        keytab = MemoryKeytab(
+            data=make_keytab(("app/hostname@EXAMPLE.COM", 1, 18, b"k"))
+        )
+
+        self.assertIsNone(keytab.filename)
+        self.assertFalse(keytab.reload_if_changed())
+
+    @patch("krbcontext.krb5_backend.krb5", new=None)
+    def test_krb5_is_required(self):
+        self.assertRaises(ValueError, MemoryKeytab, filename=self.filename)
+
+
+class TestKrbContextWithMemoryKeytab(MemoryKeytabTestCase):
+    """Test krbContext using in-memory keytab"""
+
+    @patch("gssapi.Credentials")
+    @patch("tempfile.mkdtemp", return_value="/tmp/test-krbcontext")
+    def test_renew_after_keys_are_rotated(self, mkdtemp, Credentials):
+        Credentials.return_value.lifetime = 3600
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+            keytab_data=make_keytab(("app/hostname@EXAMPLE.COM", 1, 18, b"k")),
+            backend="gssapi",
+        )
+        name = context._plan.keytab_store["client_keytab"]
+        self.assertTrue(name.startswith("MEMORY:"))
+
+        context.init_with_keytab()
+        Credentials.return_value.store.assert_not_called()
+
+        context.load_keytab(
+            make_keytab(("app/hostname@EXAMPLE.COM", 2, 18, b"k"))
+        )
+        context.init_with_keytab()
+
+        Credentials.return_value.store.assert_called_once()
+        new_name = context._plan.keytab_store["client_keytab"]
+        self.assertNotEqual(name, new_name)
+        Credentials.assert_called_with(
+            usage="initiate",
+            name=context._plan.principal,
+            store={
+                "client_keytab": new_name,
+                "ccache": "/tmp/test-krbcontext/ccache",
+            },
+        )
+
+    @patch("gssapi.Credentials")
+    def test_watch_keytab_file(self, Credentials):
+        Credentials.return_value.lifetime = 3600
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            keytab_file=self.filename,
+            keytab_in_memory=True,
+            backend="gssapi",
+        )
+        context.init_with_keytab()
+        self.assertFalse(context._check_keytab_rotation())
+
+        self.write_keytab(2)
+        self.assertTrue(context._check_keytab_rotation())
+
+    def test_keytab_is_not_in_memory(self):
+        context = krbContext(principal="cqi", backend="gssapi")
+
+        self.assertRaises(ValueError, context.load_keytab, b"")
@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+from unittest.mock import ANY, MagicMock, Mock, patch
+
+from krbcontext.context import krbContext
+from krbcontext.krb5_backend import Krb5Backend
+
+
+class Krb5Error(Exception):
+    pass
+
+
+def make_principal(name):
+    return Mock(unparsed=name, realm=name.rsplit(b"@", 1)[-1])
+
+
+class Krb5TestCase(unittest.TestCase):
+    def setUp(self):
+        self.krb5 = patch("krbcontext.krb5_backend.krb5").start()
+        self.krb5.Krb5Error = Krb5Error
+        self.krb5.parse_name_flags.side_effect = (
+            lambda context, name: make_principal(name)
+        )
+        self.krb5.unparse_name_flags.side_effect = (
+            lambda context, principal: principal.unparsed
+        )
+        self.krb5.cc_get_principal.return_value = make_principal(
+            b"app/hostname@EXAMPLE.COM"
+        )
+        self.ccache = MagicMock()
+        self.ccache.__iter__.return_value = iter(
+            [
+                Mock(
+                    server=make_principal(b"HTTP/www@EXAMPLE.COM"),
+                    times=Mock(endtime=1100),
+                ),
+                Mock(
+                    server=make_principal(b"krbtgt/EXAMPLE.COM@EXAMPLE.COM"),
+                    times=Mock(endtime=4600),
+                ),
+            ]
+        )
+        self.krb5.cc_resolve.return_value = self.ccache
+        times = Mock(authtime=1000, starttime=0, endtime=37000, renew_till=0)
+        self.krb5.get_init_creds_keytab.return_value.times = times
+        self.krb5.get_init_creds_password.return_value.times = times
+
+        self.time = patch("time.time", return_value=1000).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+
+class TestKrb5Backend(Krb5TestCase):
+    """Test Krb5Backend"""
+
+    def test_lifetime_of_tgt(self):
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache="/tmp/cc")
+
+        self.assertEqual(3600, backend.lifetime())
+        self.krb5.cc_resolve.assert_called_once_with(
+            self.krb5.init_context.return_value, b"/tmp/cc"
+        )
+
+    def test_no_lifetime_if_ccache_is_missing(self):
+        self.krb5.cc_get_principal.side_effect = Krb5Error()
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache="/tmp/cc")
+
+        self.assertEqual(0, backend.lifetime())
+
+    def test_no_lifetime_if_ccache_has_other_principal(self):
+        self.krb5.cc_get_principal.return_value = make_principal(
+            b"cqi@EXAMPLE.COM"
+        )
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache="/tmp/cc")
+
+        self.assertEqual(0, backend.lifetime())
+
+    def test_init_with_keytab(self):
+        backend = Krb5Backend(
+            "app/hostname@EXAMPLE.COM", ccache="/tmp/cc", keytab="/tmp/kt"
+        )
+
+        self.assertEqual(36000, backend.init())
+
+        context = self.krb5.init_context.return_value
+        self.krb5.kt_resolve.assert_called_once_with(context, b"/tmp/kt")
+        self.krb5.get_init_creds_keytab.assert_called_once()
+        self.krb5.cc_initialize.assert_called_once()
+        self.krb5.cc_store_cred.assert_called_once_with(
+            context,
+            self.ccache,
+            self.krb5.get_init_creds_keytab.return_value,
+        )
+
+    def test_init_with_password_into_default_ccache(self):
+        backend = Krb5Backend("cqi")
+
+        backend.init(b"security")
+
+        self.krb5.cc_default.assert_called_once()
+        self.krb5.get_init_creds_keytab.assert_not_called()
+        args = self.krb5.get_init_creds_password.call_args[0]
+        self.assertEqual(b"security", args[3])
+
+    def test_replace_ccache_file(self):
+        self.krb5.cc_get_type.return_value = b"FILE"
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "krb5cc")
+            self.krb5.cc_get_name.return_value = path.encode()
+            staged = Mock()
+            self.krb5.cc_resolve.side_effect = lambda context, name: (
+                staged if name.startswith(b"FILE:") else self.ccache
+            )
+            backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache=path)
+
+            backend.init(replace=True)
+
+            self.assertEqual(["krb5cc"], os.listdir(tempdir))
+        context = self.krb5.init_context.return_value
+        self.krb5.cc_initialize.assert_called_once_with(context, staged, ANY)
+        self.krb5.cc_store_cred.assert_called_once_with(
+            context, staged, self.krb5.get_init_creds_keytab.return_value
+        )
+
+    def test_follow_default_ccache(self):
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM")
+
+        with patch.dict("os.environ", {"KRB5CCNAME": "/tmp/cc1"}):
+            backend.lifetime()
+            backend.lifetime()
+        self.krb5.init_context.assert_called_once_with()
+
+        with patch.dict("os.environ", {"KRB5CCNAME": "/tmp/cc2"}):
+            backend.lifetime()
+        self.assertEqual(2, self.krb5.init_context.call_count)
+
+    @patch("krbcontext.krb5_backend.krb5", new=None)
+    def test_not_available(self):
+        self.assertRaises(ValueError, Krb5Backend, "cqi")
+
+
+class TestKrbContextWithKrb5Backend(Krb5TestCase):
+    """Test krbContext using krb5 backend"""
+
+    def test_gssapi_backend_by_default(self):
+        context = krbContext(
+            using_keytab=True, principal="app/hostname@EXAMPLE.COM"
+        )
+
+        self.assertIsNone(context._krb5)
+
+    def test_select_krb5_backend(self):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            backend="krb5",
+        )
+
+        self.assertIsInstance(context._krb5, Krb5Backend)
+
+    @patch("krbcontext.krb5_backend.krb5", new=None)
+    def test_krb5_backend_not_available(self):
+        self.assertRaises(
+            ValueError,
+            krbContext,
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            backend="krb5",
+        )
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, krbContext, backend="heimdal")
+
+    @patch("gssapi.Credentials")
+    def test_no_need_init_if_not_expired(self, Credentials):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/cc",
+            backend="krb5",
+        )
+        context.init_with_keytab()
+
+        self.krb5.get_init_creds_keytab.assert_not_called()
+        Credentials.assert_not_called()
+        self.assertEqual(3600, context.status()["lifetime"])
+
+    def test_init_with_keytab(self):
+        self.ccache.__iter__.return_value = iter([])
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/cc",
+            backend="krb5",
+        )
+        context.init_with_keytab()
+
+        self.krb5.get_init_creds_keytab.assert_called_once()
+        self.assertEqual(36000, context.status()["lifetime"])
+        self.assertEqual(1000, context.status()["last_renewal"])
+
+    def test_init_with_password(self):
+        self.ccache.__iter__.return_value = iter([])
+        context = krbContext(
+            principal="cqi@EXAMPLE.COM",
+            password="security",
+            ccache_file="/tmp/cc",
+            backend="krb5",
+        )
+        context.init_with_password()
+
+        args = self.krb5.get_init_creds_password.call_args[0]
+        self.assertEqual(b"security", args[3])
+
+    def test_request_lifetimes(self):
+        self.ccache.__iter__.return_value = iter([])
+        self.krb5.get_init_creds_keytab.return_value.times = Mock(
+            authtime=1000, starttime=1000, endtime=87400, renew_till=605800
+        )
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/cc",
+            backend="krb5",
+            lifetime=86400,
+            renew_lifetime=604800,
+        )
+        context.init_with_keytab()
+
+        options = self.krb5.get_init_creds_opt_alloc.return_value
+        self.krb5.get_init_creds_opt_set_tkt_life.assert_called_once_with(
+            options, 86400
+        )
+        self.krb5.get_init_creds_opt_set_renew_life.assert_called_once_with(
+            options, 604800
+        )
+        status = context.status()
+        self.assertEqual(86400, status["granted_lifetime"])
+        self.assertEqual(605800, status["renew_till"])
+
+    def test_default_lifetimes(self):
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache="/tmp/cc")
+
+        backend.init()
+
+        self.krb5.get_init_creds_opt_set_tkt_life.assert_not_called()
+        self.krb5.get_init_creds_opt_set_renew_life.assert_not_called()
+        self.assertEqual(0, backend.last_times.renew_till)
+
+
+class TestCcacheCollection(Krb5TestCase):
+    """Test using principal's ccache in a collection"""
+
+    def setUp(self):
+        super().setUp()
+        self.krb5.cc_cache_match.return_value = self.ccache
+        self.krb5.cc_get_type.return_value = b"DIR"
+        self.krb5.cc_get_name.side_effect = lambda context, ccache: (
+            b":/run/cc/tkt1" if ccache is self.ccache else b":/run/cc/tkt0"
+        )
+
+    def test_search_collection_once(self):
+        backend = Krb5Backend(
+            "app/hostname@EXAMPLE.COM", collection="DIR:/run/cc"
+        )
+
+        self.assertEqual(3600, backend.lifetime())
+        self.ccache.__iter__.return_value = iter([])
+        backend.lifetime()
+
+        context = self.krb5.init_context.return_value
+        self.krb5.cc_set_default_name.assert_called_once_with(
+            context, b"DIR:/run/cc"
+        )
+        self.krb5.cc_cache_match.assert_called_once()
+        self.krb5.cc_resolve.assert_called_once_with(
+            context, b"DIR::/run/cc/tkt1"
+        )
+
+    def test_create_ccache_in_collection(self):
+        self.krb5.cc_cache_match.side_effect = Krb5Error()
+        self.krb5.cc_new_unique.return_value = self.ccache
+        backend = Krb5Backend(
+            "app/hostname@EXAMPLE.COM", collection="DIR:/run/cc"
+        )
+
+        self.assertEqual(0, backend.lifetime())
+        backend.init()
+
+        context = self.krb5.init_context.return_value
+        self.krb5.cc_new_unique.assert_called_once_with(context, b"DIR")
+        self.krb5.cc_switch.assert_called_once_with(context, self.ccache)
+
+    def test_switch_only_if_not_primary(self):
+        backend = Krb5Backend(
+            "app/hostname@EXAMPLE.COM", collection="DIR:/run/cc"
+        )
+
+        backend.switch()
+        self.krb5.cc_switch.assert_called_once()
+
+        self.krb5.cc_default.return_value = self.ccache
+        backend.switch()
+        self.krb5.cc_switch.assert_called_once()
+
+    @patch.dict("os.environ", {"KRB5CCNAME": "DIR:/run/cc"})
+    def test_keep_collection_in_environment(self):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="DIR:/run/cc",
+            backend="krb5",
+        )
+
+        with context:
+            self.assertEqual("DIR:/run/cc", os.environ["KRB5CCNAME"])
+        self.assertEqual("DIR:/run/cc", os.environ["KRB5CCNAME"])
+
+        self.assertIsNone(context._plan.ccache_store)
+        self.krb5.cc_switch.assert_called_once()
+        self.krb5.get_init_creds_keytab.assert_not_called()
+
+    @patch.dict("os.environ", {}, clear=True)
+    def test_point_to_collection(self):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="DIR:/run/cc",
+            backend="krb5",
+        )
+
+        with context:
+            self.assertEqual("DIR:/run/cc", os.environ["KRB5CCNAME"])
+        self.assertNotIn("KRB5CCNAME", os.environ)
+
+    def test_require_krb5_backend(self):
+        self.assertRaises(
+            ValueError,
+            krbContext,
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="DIR:/run/cc",
+            backend="gssapi",
+        )
+
+
+class TestCompaction(Krb5TestCase):
+    """Test compacting ccache"""
+
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "krb5cc")
+        with open(self.path, "wb") as f:
+            f.write(b"x" * 1024)
+        self.krb5.cc_get_type.return_value = b"FILE"
+        self.krb5.cc_get_name.return_value = self.path.encode()
+
+        entries = [
+            Mock(
+                server=make_principal(b"HTTP/old@EXAMPLE.COM"),
+                times=Mock(endtime=900),
+            ),
+            Mock(
+                server=make_principal(b"HTTP/www@EXAMPLE.COM"),
+                times=Mock(endtime=1100),
+            ),
+            Mock(
+                server=make_principal(b"krbtgt/EXAMPLE.COM@EXAMPLE.COM"),
+                times=Mock(endtime=4600),
+            ),
+            Mock(
+                server=make_principal(
+                    b"krb5_ccache_conf_data/pa_type@X-CACHECONF:"
+                ),
+                times=Mock(endtime=0),
+            ),
+        ]
+        self.ccache.__iter__.side_effect = lambda: iter(entries)
+
+    def tearDown(self):
+        super().tearDown()
+        self.tempdir.cleanup()
+
+    def test_compact(self):
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache=self.path)
+
+        self.assertEqual({"entries": 1, "bytes": 1024}, backend.compact())
+
+        context = self.krb5.init_context.return_value
+        compacted = self.krb5.cc_resolve.return_value
+        self.krb5.cc_initialize.assert_called_once_with(
+            context, compacted, self.krb5.cc_get_principal.return_value
+        )
+        stored = [
+            call[0][2].server.unparsed
+            for call in self.krb5.cc_store_cred.call_args_list
+        ]
+        self.assertEqual(
+            [
+                b"HTTP/www@EXAMPLE.COM",
+                b"krbtgt/EXAMPLE.COM@EXAMPLE.COM",
+                b"krb5_ccache_conf_data/pa_type@X-CACHECONF:",
+            ],
+            stored,
+        )
+        self.assertEqual(["krb5cc"], os.listdir(self.tempdir.name))
+
+    def test_nothing_to_remove(self):
+        self.time.return_value = 800
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache=self.path)
+
+        self.assertEqual({"entries": 0, "bytes": 0}, backend.compact())
+        self.krb5.cc_initialize.assert_not_called()
+
+    def test_remove_temporary_file_on_failure(self):
+        self.krb5.cc_store_cred.side_effect = Krb5Error()
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache=self.path)
+
+        self.assertRaises(Krb5Error, backend.compact)
+        self.assertEqual(["krb5cc"], os.listdir(self.tempdir.name))
+        self.assertEqual(1024, os.path.getsize(self.path))
+
+    def test_ccache_in_collection(self):
+        self.krb5.cc_cache_match.return_value = self.ccache
+        self.krb5.cc_get_type.return_value = b"DIR"
+        self.krb5.cc_get_name.return_value = b":" + self.path.encode()
+        backend = Krb5Backend(
+            "app/hostname@EXAMPLE.COM", collection="DIR:" + self.tempdir.name
+        )
+
+        self.assertEqual(1, backend.compact()["entries"])
+
+    def test_not_a_file(self):
+        self.krb5.cc_get_type.return_value = b"KEYRING"
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache=self.path)
+
+        self.assertRaises(ValueError, backend.compact)
+
+    def test_keep_changed_ccache(self):
+        def renew(context, ccache, creds):
+            with open(self.path, "ab") as f:
+                f.write(b"\0" * 16)
+
+        self.krb5.cc_store_cred.side_effect = renew
+        backend = Krb5Backend("app/hostname@EXAMPLE.COM", ccache=self.path)
+
+        self.assertEqual({"entries": 0, "bytes": 0}, backend.compact())
+        self.assertEqual(["krb5cc"], os.listdir(self.tempdir.name))
+        self.assertEqual(1072, os.path.getsize(self.path))
+
+    @patch.dict("os.environ", {}, clear=True)
+    @patch("time.monotonic", return_value=100)
+    def test_compact_on_enter(self, monotonic):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file=self.path,
+            backend="krb5",
+            compact_interval=3600,
+        )
+
+        with context:
+            self.krb5.cc_initialize.assert_called_once()
+
+        monotonic.return_value = 200
+        with context:
+            self.krb5.cc_initialize.assert_called_once()
+
+    def test_no_compaction_on_check(self):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file=self.path,
+            backend="krb5",
+            compact_interval=3600,
+        )
+
+        self.assertEqual(3600, context.probe())
+        self.krb5.cc_initialize.assert_not_called()
+
+    @patch.dict("os.environ", {}, clear=True)
+    def test_log_failed_compaction(self):
+        self.krb5.cc_get_type.return_value = b"KEYRING"
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file=self.path,
+            backend="krb5",
+            compact_interval=3600,
+        )
+
+        with self.assertLogs("krbcontext.context", level="WARNING"):
+            with context:
+                pass
+
+    def test_require_krb5_backend(self):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            backend="gssapi",
+        )
+
+        self.assertRaises(ValueError, context.compact)
+        self.assertRaises(
+            ValueError,
+            krbContext,
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            backend="gssapi",
+            compact_interval=3600,
+        )
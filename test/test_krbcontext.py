@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import os
+import tempfile
 import unittest
 
 import gssapi
 
-from unittest.mock import call, patch, PropertyMock
+from threading import Event
+from unittest.mock import call, Mock, patch, PropertyMock
 
 import krbcontext.context as kctx
 from krbcontext.context import krbContext
@@ -103,6 +105,56 @@ class CleanArgumentsAsRegularUserTest(unittest.TestCase):
         self.assertEqual(expected_princ, context._cleaned_options["principal"])
 
 
+class TestAcquisitionPlan(unittest.TestCase):
+    """Test options precompiled for acquiring credential"""
+
+    @patch("os.path.exists", return_value=True)
+    def test_plan_with_keytab_and_ccache(self, exists):
+        context = krbContext(
+            using_keytab=True,
+            principal="HTTP/hostname@EXAMPLE.COM",
+            keytab_file="/etc/app/app.keytab",
+            ccache_file="/tmp/mycc",
+        )
+        plan = context._plan
+
+        self.assertEqual(
+            {
+                "usage": "initiate",
+                "name": context._cleaned_options["principal"],
+                "store": {
+                    "client_keytab": "/etc/app/app.keytab",
+                    "ccache": "/tmp/mycc",
+                },
+            },
+            plan.creds_opts,
+        )
+        self.assertEqual(
+            {"client_keytab": "/etc/app/app.keytab"}, plan.keytab_store
+        )
+        self.assertEqual({"ccache": "/tmp/mycc"}, plan.ccache_store)
+
+    def test_plan_with_defaults(self):
+        plan = krbContext(principal="cqi", password="security")._plan
+
+        self.assertNotIn("store", plan.creds_opts)
+        self.assertEqual({}, plan.keytab_store)
+        self.assertIsNone(plan.ccache_store)
+        self.assertEqual("security", plan.password)
+
+    def test_plan_is_immutable(self):
+        plan = krbContext(principal="cqi")._plan
+
+        with self.assertRaises(AttributeError):
+            plan.ccache = "/tmp/mycc"
+
+    def test_share_principal_name(self):
+        context1 = krbContext(principal="cqi")
+        context2 = krbContext(principal="cqi", ccache_file="/tmp/mycc")
+
+        self.assertIs(context1._plan.principal, context2._plan.principal)
+
+
 class TestInitWithKeytab(unittest.TestCase):
     """Test krbContext.init_with_keytab"""
 
@@ -547,6 +599,671 @@ class TestKrbContextManager(unittest.TestCase):
         self.assertEqual("/tmp/my_cc", os.environ["KRB5CCNAME"])
 
 
+class TestLazyContext(unittest.TestCase):
+    """Test krbContext in lazy mode"""
+
+    def setUp(self):
+        self.Credentials = patch("gssapi.Credentials").start()
+        patch.dict("os.environ", {"KRB5CCNAME": "/tmp/my_cc"}).start()
+
+        self.context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+            lazy=True,
+        )
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_do_nothing_if_credential_is_not_used(self):
+        with self.context:
+            self.assertEqual("/tmp/my_cc", os.environ["KRB5CCNAME"])
+
+        self.Credentials.assert_not_called()
+        self.assertEqual("/tmp/my_cc", os.environ["KRB5CCNAME"])
+
+    def test_prepare_context_when_ensure(self):
+        with self.context as context:
+            context.ensure()
+            context.ensure()
+            self.assertEqual("/tmp/app_cc", os.environ["KRB5CCNAME"])
+
+        self.assertEqual(1, self.Credentials.call_count)
+        self.assertEqual("/tmp/my_cc", os.environ["KRB5CCNAME"])
+
+    def test_prepare_context_when_credentials_are_used(self):
+        with self.context as context:
+            creds = context.credentials
+            self.assertEqual(self.Credentials.return_value, creds)
+            self.assertEqual("/tmp/app_cc", os.environ["KRB5CCNAME"])
+
+        self.assertEqual("/tmp/my_cc", os.environ["KRB5CCNAME"])
+
+    def test_restore_environment_if_fail_to_prepare(self):
+        self.Credentials.side_effect = gssapi.exceptions.GSSError(1, 1)
+
+        with self.context as context:
+            self.assertRaises(gssapi.exceptions.GSSError, context.ensure)
+            self.assertEqual("/tmp/my_cc", os.environ["KRB5CCNAME"])
+
+
+class TestStatus(unittest.TestCase):
+    """Test krbContext.status"""
+
+    def setUp(self):
+        self.Credentials = patch("gssapi.Credentials").start()
+        self.time = patch("time.time", return_value=1000).start()
+
+        self.context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+        )
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_nothing_known_yet(self):
+        self.assertEqual(
+            {
+                "principal": "app/hostname@EXAMPLE.COM",
+                "ccache": "/tmp/app_cc",
+                "lifetime": None,
+                "expires_at": None,
+                "last_renewal": None,
+                "granted_lifetime": None,
+                "renew_till": None,
+                "kdc_wait": 0.0,
+                "last_error": None,
+            },
+            self.context.status(),
+        )
+
+    def test_report_lifetime_of_valid_credential(self):
+        self.Credentials.return_value.lifetime = 3600
+        self.context.init_with_keytab()
+        self.time.return_value = 1600
+
+        status = self.context.status()
+
+        self.assertEqual(3000, status["lifetime"])
+        self.assertEqual(4600, status["expires_at"])
+        self.assertIsNone(status["last_renewal"])
+        self.Credentials.assert_called_once()
+
+    @patch("tempfile.mkdtemp", return_value="/tmp/test-krbcontext")
+    def test_report_renewal(self, mkdtemp):
+        type(self.Credentials.return_value).lifetime = PropertyMock(
+            side_effect=[
+                gssapi.exceptions.ExpiredCredentialsError(1, 1),
+                36000,
+            ]
+        )
+        self.context.init_with_keytab()
+
+        status = self.context.status()
+
+        self.assertEqual(36000, status["lifetime"])
+        self.assertEqual(1000, status["last_renewal"])
+        self.assertEqual(36000, status["granted_lifetime"])
+        self.assertIsNone(status["renew_till"])
+
+    @patch("tempfile.mkdtemp", return_value="/tmp/test-krbcontext")
+    def test_request_lifetime(self, mkdtemp):
+        self.Credentials.return_value.lifetime = 86400
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+            backend="gssapi",
+            lifetime=86400,
+        )
+
+        context.renew()
+
+        self.Credentials.assert_called_once_with(
+            usage="initiate",
+            name=context._plan.principal,
+            store={"ccache": "/tmp/test-krbcontext/ccache"},
+            lifetime=86400,
+        )
+        self.assertEqual(86400, context.status()["granted_lifetime"])
+
+    @patch("gssapi.raw.acquire_cred_with_password")
+    @patch("gssapi.raw.store_cred_into")
+    def test_request_lifetime_with_password(
+        self, store_cred_into, acquire_cred_with_password
+    ):
+        acquire_cred_with_password.return_value.lifetime = 7200
+        context = krbContext(
+            principal="cqi@EXAMPLE.COM",
+            password="security",
+            ccache_file="/tmp/cqi_cc",
+            backend="gssapi",
+            lifetime=86400,
+        )
+
+        context.renew()
+
+        acquire_cred_with_password.assert_called_once_with(
+            context._plan.principal, b"security", lifetime=86400
+        )
+        self.assertEqual(7200, context.status()["granted_lifetime"])
+
+    def test_renewable_lifetime_requires_krb5(self):
+        self.assertRaises(
+            ValueError,
+            krbContext,
+            principal="cqi@EXAMPLE.COM",
+            backend="gssapi",
+            renew_lifetime=604800,
+        )
+
+    @patch.dict("os.environ", {}, clear=True)
+    def test_report_last_error(self):
+        error = gssapi.exceptions.GSSError(1, 1)
+        self.Credentials.side_effect = error
+
+        self.assertRaises(gssapi.exceptions.GSSError, self.context.__enter__)
+        self.assertIs(error, self.context.status()["last_error"])
+
+        self.Credentials.side_effect = None
+        self.Credentials.return_value.lifetime = 3600
+        with self.context:
+            pass
+        self.assertIsNone(self.context.status()["last_error"])
+
+
+class TestEvents(unittest.TestCase):
+    """Test subscribing to events of credential"""
+
+    def setUp(self):
+        self.Credentials = patch("gssapi.Credentials").start()
+        patch("tempfile.mkdtemp", return_value="/tmp/test-krbcontext").start()
+
+        self.context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+            backend="gssapi",
+            expiring_threshold=300,
+        )
+        self.renewed = Mock()
+        self.expiring = Mock()
+        self.context.subscribe("renewed", self.renewed)
+        self.context.subscribe("expiring", self.expiring)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_notify_renewed(self):
+        self.Credentials.return_value.lifetime = 36000
+
+        self.context.renew()
+
+        self.renewed.assert_called_once_with(self.context)
+        self.expiring.assert_not_called()
+
+    def test_notify_expiring_once(self):
+        self.Credentials.return_value.lifetime = 200
+
+        self.context.init_with_keytab()
+        self.context.init_with_keytab()
+        self.expiring.assert_called_once_with(self.context)
+
+        self.context.renew()
+        self.context.init_with_keytab()
+        self.assertEqual(2, self.expiring.call_count)
+
+    def test_not_expiring(self):
+        self.Credentials.return_value.lifetime = 3600
+
+        self.context.init_with_keytab()
+
+        self.expiring.assert_not_called()
+        self.renewed.assert_not_called()
+
+    def test_ignore_failure_of_subscriber(self):
+        self.Credentials.return_value.lifetime = 36000
+        self.renewed.side_effect = RuntimeError()
+        other = Mock()
+        self.context.subscribe("renewed", other)
+
+        self.context.renew()
+
+        other.assert_called_once_with(self.context)
+
+    def test_unsubscribe(self):
+        self.Credentials.return_value.lifetime = 36000
+        self.context.unsubscribe("renewed", self.renewed)
+
+        self.context.renew()
+
+        self.renewed.assert_not_called()
+
+    def test_unknown_event(self):
+        self.assertRaises(ValueError, self.context.subscribe, "gone", Mock())
+
+
+class TestRenewInBackground(unittest.TestCase):
+    """Test renewing credential in a background thread"""
+
+    def setUp(self):
+        self.context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+            backend="gssapi",
+        )
+        self.renew = patch.object(self.context, "_init_credentials").start()
+        self.probe = patch.object(self.context, "probe").start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_renew(self):
+        self.context.renew_in_background().join()
+
+        self.renew.assert_called_once_with(force=True, replace=True)
+        self.probe.assert_not_called()
+
+    def test_renew_if_about_to_expire(self):
+        self.probe.return_value = 3600
+        self.context.renew_in_background(min_lifetime=600).join()
+        self.renew.assert_not_called()
+
+        self.probe.return_value = 300
+        self.context.renew_in_background(min_lifetime=600).join()
+        self.renew.assert_called_once_with(force=True, replace=True)
+
+    def test_clear_error_if_renewed_by_others(self):
+        self.context._last_error = RuntimeError()
+        self.probe.return_value = 3600
+
+        self.context.renew_in_background(min_lifetime=600).join()
+
+        self.assertIsNone(self.context.status()["last_error"])
+        self.renew.assert_not_called()
+
+    def test_reuse_running_renewal(self):
+        started = Event()
+        done = Event()
+        self.renew.side_effect = lambda **kwargs: (
+            started.set() or done.wait(5)
+        )
+
+        thread = self.context.renew_in_background()
+        started.wait(5)
+        self.assertIs(thread, self.context.renew_in_background())
+        done.set()
+        thread.join()
+
+        self.renew.assert_called_once_with(force=True, replace=True)
+
+    def test_log_failure(self):
+        self.renew.side_effect = RuntimeError()
+
+        with self.assertLogs("krbcontext.context", level="ERROR"):
+            self.context.renew_in_background().join()
+
+
+class TestReplaceCcache(unittest.TestCase):
+    """Test replacing ccache file atomically by renewal"""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "krb5cc")
+        with open(self.path, "w") as f:
+            f.write("old")
+        patch("krbcontext.ratelimit._limiter", None).start()
+
+    def tearDown(self):
+        patch.stopall()
+        self.tempdir.cleanup()
+
+    def write(self, ccache):
+        # ccache must not be touched until new one is complete.
+        with open(self.path) as f:
+            self.assertEqual("old", f.read())
+        self.assertTrue(ccache.startswith("FILE:"))
+        with open(ccache[5:], "w") as f:
+            f.write("new")
+
+    def assert_replaced(self):
+        with open(self.path) as f:
+            self.assertEqual("new", f.read())
+        self.assertEqual(["krb5cc"], os.listdir(self.tempdir.name))
+
+    @patch("gssapi.Credentials")
+    def test_renew_with_keytab(self, Credentials):
+        Credentials.return_value.lifetime = 3600
+        Credentials.return_value.store.side_effect = lambda **kwargs: (
+            self.write(kwargs["store"]["ccache"])
+        )
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file=self.path,
+            backend="gssapi",
+        )
+
+        context.renew_in_background().join()
+
+        self.assertIsNone(context.status()["last_error"])
+        self.assert_replaced()
+
+    @patch("gssapi.Credentials")
+    def test_renew(self, Credentials):
+        Credentials.return_value.lifetime = 3600
+        Credentials.return_value.store.side_effect = lambda **kwargs: (
+            self.write(kwargs["store"]["ccache"])
+        )
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file=self.path,
+            backend="gssapi",
+        )
+
+        context.renew(replace=True)
+
+        self.assert_replaced()
+
+    @patch("gssapi.raw.acquire_cred_with_password")
+    @patch("gssapi.raw.store_cred_into")
+    def test_renew_with_password(self, store_cred_into, acquire):
+        acquire.return_value.lifetime = 3600
+        store_cred_into.side_effect = lambda store, *args, **kwargs: (
+            self.write(store["ccache"])
+        )
+        context = krbContext(
+            principal="cqi@EXAMPLE.COM",
+            password="security",
+            ccache_file="FILE:" + self.path,
+            backend="gssapi",
+        )
+
+        context.renew_in_background().join()
+
+        self.assertIsNone(context.status()["last_error"])
+        self.assert_replaced()
+
+    @patch("gssapi.Credentials")
+    def test_keep_ccache_on_failure(self, Credentials):
+        Credentials.return_value.lifetime = 3600
+        Credentials.return_value.store.side_effect = (
+            gssapi.exceptions.GSSError(1, 1)
+        )
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file=self.path,
+            backend="gssapi",
+        )
+
+        context.renew_in_background().join()
+
+        self.assertIsNotNone(context.status()["last_error"])
+        with open(self.path) as f:
+            self.assertEqual("old", f.read())
+        self.assertEqual(["krb5cc"], os.listdir(self.tempdir.name))
+
+
+@patch.dict("os.environ", {}, clear=True)
+class TestSoftExpiry(unittest.TestCase):
+    """Test renewing in background when entering context"""
+
+    def setUp(self):
+        self.context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+            backend="gssapi",
+            soft_expiry=600,
+        )
+        self.init = patch.object(self.context, "_init_credentials").start()
+        self.renew_in_background = patch.object(
+            self.context, "renew_in_background"
+        ).start()
+        patch("time.time", return_value=1000).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_wait_if_lifetime_not_known(self):
+        with self.context:
+            pass
+
+        self.init.assert_called_once_with()
+        self.renew_in_background.assert_not_called()
+
+    def test_renew_in_background_after_soft_expiry(self):
+        self.context._expires_at = 1300
+
+        with self.context:
+            pass
+
+        self.renew_in_background.assert_called_once_with(600)
+        self.init.assert_not_called()
+
+    def test_check_before_soft_expiry(self):
+        self.context._expires_at = 4600
+
+        with self.context:
+            pass
+
+        self.init.assert_called_once_with()
+        self.renew_in_background.assert_not_called()
+
+    def test_wait_for_background_renewal_after_hard_expiry(self):
+        self.context._expires_at = 900
+        self.context._background_renewal = Mock()
+
+        with self.context:
+            pass
+
+        self.context._background_renewal.join.assert_called_once_with()
+        self.init.assert_called_once_with()
+
+    def test_require_keytab_or_password(self):
+        self.assertRaises(
+            ValueError,
+            krbContext,
+            principal="cqi",
+            ccache_file="/tmp/cqi_cc",
+            soft_expiry=600,
+        )
+
+    def test_require_ccache(self):
+        self.assertRaises(
+            ValueError,
+            krbContext,
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            soft_expiry=600,
+        )
+
+
+class TestImpersonate(unittest.TestCase):
+    """Test krbContext.impersonate"""
+
+    def setUp(self):
+        self.Credentials = patch("gssapi.Credentials").start()
+        self.impersonate = self.Credentials.return_value.impersonate
+        self.impersonate.side_effect = lambda *args, **kwargs: Mock(
+            lifetime=3600
+        )
+        self.monotonic = patch("time.monotonic", return_value=100).start()
+        patch("krbcontext.ratelimit._limiter", None).start()
+
+        self.context = krbContext(
+            using_keytab=True,
+            principal="HTTP/hostname@EXAMPLE.COM",
+            impersonation_cache_size=2,
+        )
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_impersonate_user(self):
+        creds = self.context.impersonate("alice@EXAMPLE.COM")
+
+        self.assertEqual(3600, creds.lifetime)
+        self.impersonate.assert_called_once_with(
+            gssapi.Name(
+                "alice@EXAMPLE.COM", gssapi.NameType.kerberos_principal
+            ),
+            lifetime=None,
+            usage="initiate",
+        )
+
+    def test_reuse_cached_credential(self):
+        creds = self.context.impersonate("alice@EXAMPLE.COM")
+        self.monotonic.return_value = 1000
+
+        self.assertIs(creds, self.context.impersonate("alice@EXAMPLE.COM"))
+        self.assertEqual(1, self.impersonate.call_count)
+
+    def test_impersonate_again_if_about_to_expire(self):
+        creds = self.context.impersonate("alice@EXAMPLE.COM")
+        self.monotonic.return_value = 3690
+
+        new_creds = self.context.impersonate("alice@EXAMPLE.COM")
+
+        self.assertIsNot(creds, new_creds)
+        self.assertEqual(2, self.impersonate.call_count)
+
+    def test_evict_least_recently_used(self):
+        alice = self.context.impersonate("alice@EXAMPLE.COM")
+        self.context.impersonate("bob@EXAMPLE.COM")
+        self.context.impersonate("alice@EXAMPLE.COM")
+        self.context.impersonate("carol@EXAMPLE.COM")
+
+        self.assertEqual(
+            ["alice@EXAMPLE.COM", "carol@EXAMPLE.COM"],
+            list(self.context._impersonated),
+        )
+        self.assertIs(alice, self.context.impersonate("alice@EXAMPLE.COM"))
+        self.assertEqual(3, self.impersonate.call_count)
+
+
+class TestCopyTo(unittest.TestCase):
+    """Test krbContext.copy_to"""
+
+    def setUp(self):
+        self.context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            ccache_file="/tmp/app_cc",
+        )
+        self.principal = self.context._plan.principal
+
+        self.source = Mock(lifetime=36000)
+        self.targets = {
+            "/tmp/cc_valid": Mock(lifetime=36000),
+            "/tmp/cc_expiring": Mock(lifetime=10),
+        }
+
+        def get_credentials(usage, name, store):
+            if store["ccache"] == "/tmp/app_cc":
+                return self.source
+            if store["ccache"] in self.targets:
+                return self.targets[store["ccache"]]
+            raise gssapi.exceptions.MissingCredentialsError(1, 1)
+
+        self.Credentials = patch("gssapi.Credentials").start()
+        self.Credentials.side_effect = get_credentials
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_copy_to_ccaches(self):
+        result = self.context.copy_to(
+            ["/tmp/cc_valid", "/tmp/cc_expiring", "/tmp/cc_new"],
+            max_workers=2,
+        )
+
+        self.assertEqual(
+            {
+                "/tmp/cc_valid": False,
+                "/tmp/cc_expiring": True,
+                "/tmp/cc_new": True,
+            },
+            result,
+        )
+        self.source.store.assert_has_calls(
+            [
+                call(
+                    usage="initiate",
+                    store={"ccache": "/tmp/cc_expiring"},
+                    overwrite=True,
+                ),
+                call(
+                    usage="initiate",
+                    store={"ccache": "/tmp/cc_new"},
+                    overwrite=True,
+                ),
+            ],
+            any_order=True,
+        )
+        self.assertEqual(2, self.source.store.call_count)
+
+    def test_copy_if_not_valid_long_enough(self):
+        result = self.context.copy_to(["/tmp/cc_valid"], min_lifetime=40000)
+
+        self.assertEqual({"/tmp/cc_valid": True}, result)
+
+
+class TestNegotiateHeader(unittest.TestCase):
+    """Test krbContext.negotiate_header"""
+
+    def setUp(self):
+        self.context = krbContext(
+            using_keytab=True, principal="HTTP/hostname@EXAMPLE.COM"
+        )
+
+        self.Credentials = patch("gssapi.Credentials").start()
+        self.Name = patch("gssapi.Name").start()
+        self.SecurityContext = patch("gssapi.SecurityContext").start()
+        self.SecurityContext.return_value.step.return_value = b"token"
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_build_header(self):
+        header = self.context.negotiate_header("HTTP@www.example.com")
+
+        self.assertEqual("Negotiate dG9rZW4=", header)
+        self.Name.assert_called_with(
+            "HTTP@www.example.com", gssapi.NameType.hostbased_service
+        )
+        self.SecurityContext.assert_called_once_with(
+            name=self.Name.return_value.canonicalize.return_value,
+            creds=self.Credentials.return_value,
+            mech=kctx.SPNEGO_MECH,
+            usage="initiate",
+        )
+
+    def test_target_in_principal_name(self):
+        self.context.negotiate_header("HTTP/www.example.com@EXAMPLE.COM")
+
+        self.Name.assert_called_with(
+            "HTTP/www.example.com@EXAMPLE.COM",
+            gssapi.NameType.kerberos_principal,
+        )
+
+    def test_reuse_canonicalized_name_and_credential(self):
+        self.context.negotiate_header("HTTP@www.example.com")
+        self.context.negotiate_header("HTTP@www.example.com")
+
+        self.Name.return_value.canonicalize.assert_called_once_with(
+            gssapi.MechType.kerberos
+        )
+        self.assertEqual(1, self.Credentials.call_count)
+        self.assertEqual(2, self.SecurityContext.call_count)
+
+
 class TestGetLogin(unittest.TestCase):
     """Test get_login"""
 
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import unittest
+
+from unittest.mock import Mock, patch
+
+from krbcontext.middleware import KrbASGIMiddleware, KrbWSGIMiddleware
+
+OPTIONS = {
+    "using_keytab": True,
+    "principal": "app/hostname@EXAMPLE.COM",
+    "ccache_file": "/tmp/app_cc",
+    "backend": "gssapi",
+}
+
+
+def wsgi_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"ok"]
+
+
+class MiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        patch.dict("os.environ", {}, clear=True).start()
+        self.init = patch(
+            "krbcontext.context.krbContext._init_credentials"
+        ).start()
+        self.status = patch("krbcontext.context.krbContext.status").start()
+        self.status.return_value = {
+            "principal": "app/hostname@EXAMPLE.COM",
+            "ccache": "/tmp/app_cc",
+            "lifetime": 3600,
+            "last_error": None,
+        }
+        self.renew_in_background = patch(
+            "krbcontext.context.krbContext.renew_in_background"
+        ).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+
+class TestKrbWSGIMiddleware(MiddlewareTestCase):
+    """Test KrbWSGIMiddleware"""
+
+    def call(self, app):
+        environ = {}
+        start_response = Mock()
+        body = app(environ, start_response)
+        return environ, start_response, body
+
+    def test_set_up_once(self):
+        app = KrbWSGIMiddleware(wsgi_app, OPTIONS)
+
+        environ, start_response, body = self.call(app)
+        self.call(app)
+
+        self.assertEqual([b"ok"], body)
+        self.assertEqual("/tmp/app_cc", os.environ["KRB5CCNAME"])
+        self.init.assert_called_once_with()
+        self.renew_in_background.assert_not_called()
+        self.assertIs(app._binding.context, environ["krbcontext.context"])
+        self.assertGreaterEqual(environ["krbcontext.elapsed"], 0)
+        start_response.assert_called_once_with(
+            "200 OK", [("Content-Type", "text/plain")]
+        )
+
+    def test_set_up_again_after_fork(self):
+        app = KrbWSGIMiddleware(wsgi_app, OPTIONS)
+        self.call(app)
+        context = app._binding.context
+
+        with patch("os.getpid", return_value=-1):
+            self.call(app)
+
+        self.assertIsNot(context, app._binding.context)
+        self.assertEqual(2, self.init.call_count)
+
+    def test_renew_in_background(self):
+        app = KrbWSGIMiddleware(wsgi_app, OPTIONS, min_lifetime=600)
+        self.call(app)
+        self.status.return_value["lifetime"] = 300
+
+        self.call(app)
+
+        self.renew_in_background.assert_called_once_with(600)
+        self.renew_in_background.return_value.join.assert_not_called()
+
+    def test_wait_if_expired(self):
+        app = KrbWSGIMiddleware(wsgi_app, OPTIONS, min_lifetime=600)
+        self.call(app)
+        self.status.return_value["lifetime"] = 0
+
+        self.call(app)
+
+        self.renew_in_background.return_value.join.assert_called_once_with()
+
+    def test_raise_error_of_renewal(self):
+        app = KrbWSGIMiddleware(wsgi_app, OPTIONS)
+        self.call(app)
+        self.status.return_value["lifetime"] = 0
+        self.status.return_value["last_error"] = RuntimeError("KDC is down")
+
+        self.assertRaises(RuntimeError, self.call, app)
+
+    def test_ignore_error_if_credential_is_valid(self):
+        app = KrbWSGIMiddleware(wsgi_app, OPTIONS)
+        self.call(app)
+        self.status.return_value["lifetime"] = 0
+        self.status.return_value["last_error"] = RuntimeError("KDC is down")
+
+        def join():
+            # Ccache is found renewed by another process.
+            self.status.return_value["lifetime"] = 3600
+
+        self.renew_in_background.return_value.join.side_effect = join
+
+        _, _, body = self.call(app)
+        self.assertEqual([b"ok"], body)
+
+    def test_server_timing(self):
+        app = KrbWSGIMiddleware(wsgi_app, OPTIONS, server_timing=True)
+
+        _, start_response, _ = self.call(app)
+
+        headers = start_response.call_args[0][1]
+        self.assertEqual("Server-Timing", headers[-1][0])
+        self.assertTrue(headers[-1][1].startswith("krbcontext;dur="))
+
+
+class TestKrbASGIMiddleware(MiddlewareTestCase):
+    """Test KrbASGIMiddleware"""
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.scopes = []
+
+    def tearDown(self):
+        super().tearDown()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    async def asgi_app(self, scope, receive, send):
+        self.scopes.append(scope)
+        if scope["type"] == "http":
+            await send({"type": "http.response.start", "status": 200})
+
+    def call(self, app, scope_type="http"):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": scope_type}
+        self.loop.run_until_complete(app(scope, Mock(), send))
+        return scope, sent
+
+    def test_set_up_once(self):
+        app = KrbASGIMiddleware(self.asgi_app, OPTIONS)
+
+        scope, sent = self.call(app)
+        self.call(app)
+
+        self.init.assert_called_once_with()
+        self.assertNotIn("krbcontext.context", scope)
+        self.assertIs(
+            app._binding.context, self.scopes[0]["krbcontext.context"]
+        )
+        self.assertEqual(
+            [{"type": "http.response.start", "status": 200}], sent
+        )
+
+    def test_skip_lifespan(self):
+        app = KrbASGIMiddleware(self.asgi_app, OPTIONS)
+
+        self.call(app, scope_type="lifespan")
+
+        self.init.assert_not_called()
+        self.assertEqual([{"type": "lifespan"}], self.scopes)
+
+    def test_wait_if_expired(self):
+        app = KrbASGIMiddleware(self.asgi_app, OPTIONS)
+        self.call(app)
+        self.status.return_value["lifetime"] = 0
+
+        self.call(app)
+
+        self.renew_in_background.return_value.join.assert_called_once_with()
+
+    def test_server_timing(self):
+        app = KrbASGIMiddleware(self.asgi_app, OPTIONS, server_timing=True)
+
+        _, sent = self.call(app)
+
+        name, value = sent[0]["headers"][-1]
+        self.assertEqual(b"server-timing", name)
+        self.assertTrue(value.startswith(b"krbcontext;dur="))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from unittest.mock import Mock, call
+
+from krbcontext.pool import GradualRecycler
+
+
+class TestGradualRecycler(unittest.TestCase):
+    """Test GradualRecycler"""
+
+    def test_recycle_over_window(self):
+        recycle = Mock()
+        recycler = GradualRecycler(lambda: [1, 2, 3], recycle, window=0.3)
+
+        start = time.monotonic()
+        recycler(Mock())
+        recycler.join(5)
+
+        self.assertEqual([call(1), call(2), call(3)], recycle.call_args_list)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_ignore_failure(self):
+        recycle = Mock(side_effect=[IOError(), None])
+        recycler = GradualRecycler(lambda: [1, 2], recycle, window=0)
+
+        recycler()
+        recycler.join(5)
+
+        self.assertEqual(2, recycle.call_count)
+
+    def test_cancel_previous_recycling(self):
+        recycle = Mock()
+        recycler = GradualRecycler(lambda: [1, 2], recycle, window=60)
+
+        recycler()
+        recycler.cancel()
+        recycler.join(5)
+
+        recycle.assert_called_once_with(1)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from unittest.mock import patch
+
+from krbcontext import process
+from krbcontext.process import (
+    KrbProcessPoolExecutor,
+    init_worker,
+    worker_context,
+)
+
+OPTIONS = {"principal": "cqi@EXAMPLE.COM", "ccache_file": "/tmp/cqi_cc"}
+
+
+def ccache_in_worker():
+    return (
+        os.environ.get("KRB5CCNAME"),
+        worker_context().status()["ccache"],
+    )
+
+
+class TestInitWorker(unittest.TestCase):
+    """Test init_worker"""
+
+    def tearDown(self):
+        process._worker_context = None
+
+    @patch.dict("os.environ", {}, clear=True)
+    @patch("krbcontext.context.krbContext._init_credentials")
+    def test_init_worker(self, _init_credentials):
+        init_worker(OPTIONS)
+
+        self.assertEqual("/tmp/cqi_cc", os.environ["KRB5CCNAME"])
+        self.assertEqual(
+            "cqi@EXAMPLE.COM", worker_context().status()["principal"]
+        )
+        _init_credentials.assert_called_once_with()
+
+    @patch.dict("os.environ", {"KRB5CCNAME": "/tmp/other_cc"})
+    @patch("krbcontext.context.krbContext._init_credentials")
+    def test_ccache_kept_valid_by_parent(self, _init_credentials):
+        init_worker({"principal": "cqi@EXAMPLE.COM"}, init=False)
+
+        self.assertNotIn("KRB5CCNAME", os.environ)
+        _init_credentials.assert_not_called()
+
+    def test_not_set_up(self):
+        self.assertRaises(ValueError, worker_context)
+
+
+class TestKrbProcessPoolExecutor(unittest.TestCase):
+    """Test KrbProcessPoolExecutor"""
+
+    @patch("krbcontext.context.krbContext.renew")
+    @patch("krbcontext.context.krbContext.probe", side_effect=[0, 3600])
+    def test_renew_in_parent(self, probe, renew):
+        with KrbProcessPoolExecutor(OPTIONS, max_workers=1) as executor:
+            renew.assert_called_once_with(replace=True)
+            result = executor.submit(ccache_in_worker).result(timeout=30)
+
+        self.assertEqual(("/tmp/cqi_cc", "/tmp/cqi_cc"), result)
+        self.assertEqual(2, probe.call_count)
+        renew.assert_called_once_with(replace=True)
+
+    @patch("krbcontext.context.krbContext.probe")
+    def test_require_ccache(self, probe):
+        self.assertRaises(
+            ValueError,
+            KrbProcessPoolExecutor,
+            {"principal": "cqi@EXAMPLE.COM"},
+            max_workers=1,
+        )
+        probe.assert_not_called()
+
+    @patch("krbcontext.context.krbContext.probe", return_value=3600)
+    def test_no_io_if_valid_long_enough(self, probe):
+        with KrbProcessPoolExecutor(OPTIONS, max_workers=1) as executor:
+            probe.reset_mock()
+            with patch.object(
+                executor.context, "status", return_value={"lifetime": 3600}
+            ):
+                executor.refresh()
+
+        probe.assert_not_called()
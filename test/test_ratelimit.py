@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from unittest.mock import Mock, patch
+
+from krbcontext import ratelimit
+from krbcontext.context import krbContext
+from krbcontext.ratelimit import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test TokenBucket"""
+
+    @patch("time.monotonic", return_value=100)
+    def test_reserve(self, monotonic):
+        bucket = TokenBucket(rate=2, burst=2)
+
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0.5, bucket.reserve())
+        self.assertEqual(1.0, bucket.reserve())
+
+        monotonic.return_value = 102
+        self.assertEqual(0, bucket.reserve())
+
+    @patch("time.monotonic", return_value=100)
+    def test_refill_up_to_burst(self, monotonic):
+        bucket = TokenBucket(rate=1, burst=1)
+        bucket.reserve()
+
+        monotonic.return_value = 1000
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(1.0, bucket.reserve())
+
+    def test_invalid_limit(self):
+        self.assertRaises(ValueError, TokenBucket, 0, 1)
+        self.assertRaises(ValueError, TokenBucket, 1, 0)
+
+
+class TestConfigure(unittest.TestCase):
+    """Test configure"""
+
+    def tearDown(self):
+        ratelimit.configure(None)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(ratelimit.get_limiter())
+
+    def test_configure(self):
+        ratelimit.configure(rate=1, burst=5)
+        self.assertEqual(5, ratelimit.get_limiter().burst)
+
+        ratelimit.configure(None)
+        self.assertIsNone(ratelimit.get_limiter())
+
+
+class TestRateLimitedContext(unittest.TestCase):
+    """Test krbContext waiting for rate limit"""
+
+    def setUp(self):
+        self.Credentials = patch("gssapi.Credentials").start()
+        self.Credentials.return_value.lifetime = 3600
+        patch("tempfile.mkdtemp", return_value="/tmp/test-krbcontext").start()
+        self.sleep = patch("time.sleep").start()
+        self.limiter = patch("krbcontext.ratelimit._limiter").start()
+        self.limiter.reserve.return_value = 0.5
+
+        self.context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            backend="gssapi",
+        )
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_wait_before_renewal(self):
+        self.context.renew()
+
+        self.sleep.assert_called_once_with(0.5)
+        self.assertEqual(0.5, self.context.status()["kdc_wait"])
+
+    def test_wait_before_impersonation(self):
+        self.context.impersonate("cqi@EXAMPLE.COM")
+
+        self.sleep.assert_called_once_with(0.5)
+
+    @patch("gssapi.Name")
+    @patch("gssapi.SecurityContext")
+    def test_wait_before_negotiation(self, SecurityContext, Name):
+        SecurityContext.return_value.step.return_value = b"token"
+
+        self.context.negotiate_header("HTTP@www.example.com")
+
+        self.sleep.assert_called_once_with(0.5)
+
+    @patch("gssapi.Name")
+    @patch("gssapi.SecurityContext")
+    def test_no_wait_for_cached_service_ticket(self, SecurityContext, Name):
+        SecurityContext.return_value.step.return_value = b"token"
+
+        for _ in range(40):
+            self.context.negotiate_header("HTTP@www.example.com")
+        self.assertEqual(1, self.limiter.reserve.call_count)
+
+        self.context.negotiate_header("HTTP@other.example.com")
+        self.assertEqual(2, self.limiter.reserve.call_count)
+
+        # Service tickets are got again with new credential.
+        self.context.renew()
+        self.limiter.reserve.reset_mock()
+        self.Credentials.return_value = Mock(lifetime=3600)
+        self.context.negotiate_header("HTTP@www.example.com")
+        self.context.negotiate_header("HTTP@www.example.com")
+        self.assertEqual(1, self.limiter.reserve.call_count)
+
+    def test_no_wait_if_credential_is_valid(self):
+        self.context.init_with_keytab()
+
+        self.limiter.reserve.assert_not_called()
+        self.sleep.assert_not_called()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from unittest.mock import patch
+
+from krbcontext.context import krbContext
+from krbcontext.trace import (
+    TraceEvent,
+    capture_trace,
+    kdc_exchanges,
+    parse_trace,
+)
+
+TRACE = """\
+[1234] 1700000000.100000: Getting initial credentials for app@EXAMPLE.COM
+[1234] 1700000000.100100: Sending request (180 bytes) to EXAMPLE.COM
+[1234] 1700000000.100200: Resolving hostname kdc1.example.com
+[1234] 1700000000.200000: Sending initial UDP request to dgram 10.0.0.1:88
+[1234] 1700000001.200000: Initiating TCP connection to stream 10.0.0.2:88
+[1234] 1700000001.200100: Sending TCP request to stream 10.0.0.2:88
+[1234] 1700000001.300000: Received answer (230 bytes) from stream 10.0.0.2:88
+[1234] 1700000001.300100: Terminating TCP connection to stream 10.0.0.2:88
+[1234] 1700000001.300200: Received error from KDC: -1765328359/Additional \
+pre-authentication required
+[1234] 1700000001.300300: Processing preauth types: PA-ETYPE-INFO2 (19)
+[1234] 1700000001.300400: Sending request (270 bytes) to EXAMPLE.COM
+[1234] 1700000001.300500: Sending initial UDP request to dgram 10.0.0.2:88
+[1234] 1700000001.400500: Received answer (700 bytes) from dgram 10.0.0.2:88
+[1234] 1700000001.400600: Storing app@EXAMPLE.COM -> krbtgt/EXAMPLE.COM@\
+EXAMPLE.COM in FILE:/tmp/app_cc
+not a trace line
+"""
+
+
+class TestParseTrace(unittest.TestCase):
+    """Test parse_trace and kdc_exchanges"""
+
+    def test_parse(self):
+        events = parse_trace(TRACE)
+
+        self.assertEqual(14, len(events))
+        self.assertEqual(
+            [
+                "other",
+                "request",
+                "resolve",
+                "send",
+                "connect",
+                "send",
+                "receive",
+                "close",
+                "kdc_error",
+                "preauth",
+                "request",
+                "send",
+                "receive",
+                "store",
+            ],
+            [event.kind for event in events],
+        )
+        self.assertEqual(
+            TraceEvent(
+                1700000000.2,
+                "send",
+                "dgram 10.0.0.1:88",
+                "Sending initial UDP request to dgram 10.0.0.1:88",
+            ),
+            events[3],
+        )
+        self.assertEqual("EXAMPLE.COM", events[1].server)
+
+    def test_kdc_exchanges(self):
+        exchanges = kdc_exchanges(parse_trace(TRACE))
+
+        self.assertEqual(2, len(exchanges))
+        first, second = exchanges
+        self.assertEqual("EXAMPLE.COM", first["realm"])
+        self.assertEqual(
+            ["dgram 10.0.0.1:88", "stream 10.0.0.2:88"], first["attempts"]
+        )
+        self.assertEqual("stream 10.0.0.2:88", first["server"])
+        self.assertAlmostEqual(1.2, first["elapsed"], places=3)
+        self.assertEqual(
+            "-1765328359/Additional pre-authentication required",
+            first["error"],
+        )
+        self.assertEqual(["dgram 10.0.0.2:88"], second["attempts"])
+        self.assertAlmostEqual(0.1, second["elapsed"], places=3)
+        self.assertIsNone(second["error"])
+
+    def test_no_answer(self):
+        lines = TRACE.splitlines()[:4]
+        exchanges = kdc_exchanges(parse_trace("\n".join(lines)))
+
+        self.assertIsNone(exchanges[0]["elapsed"])
+        self.assertIsNone(exchanges[0]["server"])
+
+
+class TestCaptureTrace(unittest.TestCase):
+    """Test capture_trace"""
+
+    @patch.dict("os.environ", {"KRB5_TRACE": "/dev/stderr"})
+    def test_capture(self):
+        with capture_trace() as events:
+            filename = os.environ["KRB5_TRACE"]
+            with open(filename, "w") as f:
+                f.write(TRACE)
+
+        self.assertEqual("/dev/stderr", os.environ["KRB5_TRACE"])
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(14, len(events))
+
+    @patch.dict("os.environ", {"KRB5_TRACE": "/dev/stderr"})
+    def test_overlapping_captures(self):
+        lines = TRACE.splitlines(keepends=True)
+        first = capture_trace()
+        first_events = first.__enter__()
+        filename = os.environ["KRB5_TRACE"]
+        with open(filename, "a") as f:
+            f.writelines(lines[:2])
+
+        with capture_trace() as second_events:
+            self.assertEqual(filename, os.environ["KRB5_TRACE"])
+            with open(filename, "a") as f:
+                f.writelines(lines[2:4])
+        self.assertEqual(filename, os.environ["KRB5_TRACE"])
+
+        first.__exit__(None, None, None)
+
+        self.assertEqual("/dev/stderr", os.environ["KRB5_TRACE"])
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(2, len(second_events))
+        self.assertEqual(4, len(first_events))
+
+    @patch.dict("os.environ", {}, clear=True)
+    def test_remove_variable(self):
+        with capture_trace():
+            pass
+        self.assertNotIn("KRB5_TRACE", os.environ)
+
+
+class TestTraceContext(unittest.TestCase):
+    """Test trace of krbContext"""
+
+    def setUp(self):
+        self.Credentials = patch("gssapi.Credentials").start()
+        self.Credentials.return_value.lifetime = 3600
+
+        def write_trace(**kwargs):
+            with open(os.environ["KRB5_TRACE"], "w") as f:
+                f.write(TRACE)
+            return self.Credentials.return_value
+
+        self.Credentials.side_effect = write_trace
+
+    def tearDown(self):
+        patch.stopall()
+
+    @patch("tempfile.mkdtemp", return_value="/tmp/test-krbcontext")
+    def test_trace_renewal(self, mkdtemp):
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            backend="gssapi",
+            trace=True,
+        )
+        self.assertIsNone(context.last_trace)
+
+        with patch.dict("os.environ", {}, clear=True):
+            context.renew()
+            self.assertNotIn("KRB5_TRACE", os.environ)
+
+        self.assertEqual(14, len(context.last_trace))
+        self.assertEqual(2, len(kdc_exchanges(context.last_trace)))
+
+    @patch("tempfile.mkdtemp", return_value="/tmp/test-krbcontext")
+    def test_no_trace_by_default(self, mkdtemp):
+        self.Credentials.side_effect = None
+        context = krbContext(
+            using_keytab=True,
+            principal="app/hostname@EXAMPLE.COM",
+            backend="gssapi",
+        )
+
+        context.renew()
+
+        self.assertIsNone(context.last_trace)